@@ -0,0 +1,581 @@
+import geopandas as gpd
+import io
+import json
+import contextlib
+import pandas as pd
+import numpy as np
+import math
+import os
+import sys
+import time
+import shutil
+import subprocess
+import tempfile
+import tracemalloc
+import zipfile
+from shapely.geometry import Polygon
+from lavote_data_processing import (format_tooltips, aggregate_votes, round_gdf, consolidate_vote_centers, VC_SUM_COLS,
+    process_precincts, process_votecenters, merge_precinct_counts, geojson_chunks, topojson_chunks, write_stats_js, COUNT_COLS)
+from ingest import read_votes, read_registered_voters
+from instrumentation import stage, pop_stages, print_stages, write_run_log
+
+data_folder = 'data/most_recent/'
+precincts_shape = 'data/static/registrar_precincts_4326/registrar_precincts.shp'
+registered_voters = '1- Count of registered voters by precinct.csv'
+voters = '2- Count of votes cast (broken out by VBM and in-person ballots) by precinct and VBM return method.csv'
+votecenter_voters = '3- Count of in-person ballots cast for each vote center with VBM return method_LA.csv'
+votecenter_gjson = 'data/static/vote_centers_locs.geojson'
+votecenter_alloc = 'data/static/LA Vote Center_allocations_20201027.xlsx'
+override_file = 'data/static/vc_name_overrides.csv'
+benchmark_runs = 'data/runs/benchmarks'
+
+def read_most_recent_bytes(filename):
+    """
+    Reads the raw contents of one of the registrar csvs from data/most_recent, 
+    falling back to the most recent zip file if the csv has not been extracted.
+
+    Args:
+    filename (str): Name of the csv within the registrar zip file.
+
+    Return:
+    contents (bytes): Contents of the csv.
+    """
+    if os.path.exists(data_folder+filename):
+        with open(data_folder+filename, 'rb') as f:
+            return f.read()
+    zipfiles = [data_folder+file for file in os.listdir(data_folder) if '.zip' in file]
+    zipfiles.sort(key=os.path.getmtime)
+    with zipfile.ZipFile(zipfiles[-1], 'r') as zip_ref:
+        return zip_ref.read(filename)
+
+def read_most_recent(filename):
+    """
+    Reads one of the registrar csvs from data/most_recent with read_most_recent_bytes().
+
+    Return:
+    df (pandas dataframe): Contents of the csv.
+    """
+    return pd.read_csv(io.BytesIO(read_most_recent_bytes(filename)))
+
+def precinct_counts():
+    """
+    Builds the precinct level vote counts that are passed to format_tooltips()
+    from the files in data/most_recent.
+
+    Return:
+    df (pandas dataframe): Registered voters and vote counts by precinct.
+    """
+    reg = read_most_recent(registered_voters)
+    vote = read_most_recent(voters)
+    df, county = aggregate_votes(vote)
+    df = df.set_index('PrecinctNumber')
+    reg = reg.set_index('Voter Precinct Number')['# of Active Voters']
+    df = df.join(reg.rename('Number of Active Voters'), how='outer').fillna(0)
+    # match the object columns that process_precincts carries into the tooltip step
+    df['Date/Time Extract Run'] = ''
+    return df.reset_index(drop=True)
+
+def format_tooltips_iterrows(df):
+    """
+    Row by row tooltip formatting used by process_precincts before 
+    format_tooltips(), kept as the baseline for benchmarking.
+    """
+    cols = ['Total Votes', 'Mail', 'In Person Live Ballot', 'Drop Box', 'Vote Center Drop Off']
+    new_cols = ['Percent Votes Cast', 'Percent Mail', 'Percent Poll', 'Percent Drop Box', 
+                'Percent Vote Center Drop Off']
+    for idx, row in df.iterrows():
+        for i, col in enumerate(cols):
+            if (col == 'Total Votes') & (row['Number of Active Voters'] > 0):
+                pct = round((row[col]/row['Number of Active Voters'])*100, 1)
+            elif row['Total Votes'] > 0:
+                pct = round((row[col]/row['Total Votes'])*100, 1)
+            else:
+                pct = np.nan
+            if math.isnan(pct):
+                df.at[idx, new_cols[i]] = 'n/a' 
+            elif col == 'Total Votes':
+                df.at[idx, new_cols[i]] = str(pct) + '%'
+            else:
+                df.at[idx, new_cols[i]] = str(pct) + '% (' + str(int(row[col])) + ')'
+    return df
+
+def aggregate_votes_groupbys(vote):
+    """
+    Filtered groupby and merge aggregation used by process_precincts before
+    aggregate_votes(), kept as the baseline for benchmarking.
+    """
+    mail = vote.loc[vote['VBM Return Method Code'] == 'Mail']
+    mail = mail.groupby(['VPH HomePrecinct Number']).sum(numeric_only=True).reset_index()
+    mail['VBM Return Method Code'] = 'Mail'
+    db = vote.loc[vote['VBM Return Method Code'] == 'Drop Box']
+    db = db.groupby(['VPH HomePrecinct Number']).sum(numeric_only=True).reset_index()
+    db['VBM Return Method Code'] = 'Drop Box'
+    do = vote.loc[vote['VBM Return Method Code'] == 'Vote Center Drop Off']
+    do = do.groupby(['VPH HomePrecinct Number']).sum(numeric_only=True).reset_index()
+    do['VBM Return Method Code'] = 'Vote Center Drop Off'
+    all_mail = mail.merge(db, on='VPH HomePrecinct Number', how='outer', suffixes=(None, '_db'), validate='1:1').merge(do, on='VPH HomePrecinct Number', how='outer', suffixes=(None, '_do'), validate='1:1')
+    all_mail = all_mail[['# of Votes accepted', 'VPH HomePrecinct Number', '# of Votes accepted_db', '# of Votes accepted_do']]
+    all_mail.rename(columns = {
+        '# of Votes accepted' : 'Mail',
+        '# of Votes accepted_db' : 'Drop Box',
+        '# of Votes accepted_do' : 'Vote Center Drop Off',
+    }, inplace=True)
+    polls = vote.loc[vote['Voting Type'] == 'In Person Live Ballot']
+    polls = polls.groupby(['VPH HomePrecinct Number']).sum(numeric_only=True).reset_index()
+    total = vote.groupby('VPH HomePrecinct Number').sum(numeric_only=True).reset_index()
+    cvr = vote.loc[vote['Voting Type'] == 'CVR']
+    cvr = cvr.groupby(['VPH HomePrecinct Number']).sum(numeric_only=True).reset_index()
+    join = all_mail.merge(polls, on='VPH HomePrecinct Number', how='outer', validate='1:1').merge(cvr, on='VPH HomePrecinct Number', how='outer', suffixes=(None, '_cvr'), validate='1:1').merge(total, on='VPH HomePrecinct Number', how='outer', suffixes=(None, '_total'), validate='1:1')
+    join = join[['Mail', 'VPH HomePrecinct Number', 'Drop Box', 'Vote Center Drop Off', '# of Votes accepted',
+            '# of Votes accepted_cvr', '# of Votes accepted_total']]
+    join.rename(columns = {
+        '# of Votes accepted' : 'In Person Live Ballot',
+        '# of Votes accepted_cvr' : 'Conditional Voter Registration',
+        '# of Votes accepted_total' : 'Total Votes',
+        'VPH HomePrecinct Number' : 'PrecinctNumber'
+    }, inplace=True)
+    join = join.fillna(value=0)
+    county = pd.Series({
+        'Mail' : vote.loc[vote['VBM Return Method Code'] == 'Mail', '# of Votes accepted'].sum(),
+        'Drop Box' : vote.loc[vote['VBM Return Method Code'] == 'Drop Box', '# of Votes accepted'].sum(),
+        'Vote Center Drop Off' : vote.loc[vote['VBM Return Method Code'] == 'Vote Center Drop Off', '# of Votes accepted'].sum(),
+        'In Person Live Ballot' : vote.loc[vote['Voting Type'] == 'In Person Live Ballot', '# of Votes accepted'].sum(),
+        'Conditional Voter Registration' : vote.loc[vote['Voting Type'] == 'CVR', '# of Votes accepted'].sum(),
+        'Total Votes' : vote['# of Votes accepted'].sum(),
+    })
+    return join, county
+
+def round_gdf_per_polygon(gdf, places=6, tolerance=0.0000005):
+    """
+    Per polygon coordinate rounding used by round_gdf() before it rounded all 
+    coordinates at once, kept as the baseline for benchmarking. Only rounds
+    Polygons without holes.
+    """
+    def round_polygon(polygon):
+        if (polygon.type == 'Polygon' and polygon.length == polygon.exterior.length):
+            rounded_coords = [[round(coord,places) for coord in x] for x in polygon.exterior.coords]
+            return Polygon(rounded_coords)
+        else:
+            return polygon
+    if tolerance > 0:
+        gdf['geometry'] = gdf.geometry.simplify(tolerance)
+    if places > 0:
+        gdf['geometry'] = gdf.geometry.map(round_polygon)
+    return gdf
+
+def read_votes_untyped(csv):
+    """
+    Untyped read of every column and row by row precinct number cleanup used by 
+    process_precincts before read_votes(), kept as the baseline for benchmarking.
+    """
+    vote = pd.read_csv(csv)
+    vote['VPH HomePrecinct Number'] = vote['VPH HomePrecinct Number'].astype(str).apply(lambda x: x.replace(".", "").replace("-", ""))
+    return vote
+
+def consolidate_vote_centers_lambda(vc_final):
+    """
+    Groupby with a python function taking the first row of every non-summed 
+    column used by process_votecenters before consolidate_vote_centers(), kept 
+    as the baseline for benchmarking.
+    """
+    first = lambda x: x.iloc[0]
+    sum_cols = ['# of Votes accepted', 'bmd_allocated', 'ePollBook_Allocated']
+    return vc_final.groupby('Address', as_index=False).agg({**{col: np.sum for col in sum_cols}, **{col: first for col in vc_final.columns if col not in sum_cols + ["Address"]}})
+
+def scaled_vote_centers(copies, seed=0):
+    """
+    Builds vote center data shaped like the input to consolidate_vote_centers()
+    by repeating the LA vote center geojson with distinct addresses for each copy,
+    with random votes and allocations (some na) and a vote center without an address.
+
+    Args:
+    copies (int): Number of copies of the LA vote centers.
+    seed (int): Random seed (default 0).
+
+    Return:
+    vc_final (geopandas dataframe): Vote center data.
+    """
+    rng = np.random.default_rng(seed)
+    vc_gdf = gpd.read_file(votecenter_gjson)
+    vc_final = pd.concat([vc_gdf.assign(Address=vc_gdf['Address'] + ' #%d' % copy) for copy in range(copies)], ignore_index=True)
+    for col in VC_SUM_COLS:
+        vc_final[col] = np.where(rng.random(len(vc_final)) < 0.05, np.nan, rng.integers(0, 3000, len(vc_final)))
+    vc_final['size'] = rng.choice(['SMALL', 'MEDIUM', 'LARGE'], len(vc_final))
+    vc_final.loc[len(vc_final)] = {'Name' : 'NO ADDRESS', '# of Votes accepted' : 10}
+    return gpd.GeoDataFrame(vc_final, geometry='geometry')
+
+def scaled_extract(copies, scale_dir, precincts_shape=precincts_shape):
+    """
+    Builds a synthetic extract shaped like a run on more precincts by repeating 
+    the LA precincts and vote centers, each copy shifted east of the last and 
+    with its own precinct numbers, vote center names, addresses and ids. Writes 
+    the precinct shapefile, vote center geojson and allocations for the copies 
+    to scale_dir.
+
+    Args:
+    copies (int): Number of copies of LA (e.g. 4 for about the number of precincts statewide).
+    scale_dir (str): Directory location to write the scaled static files to.
+    precincts_shape (str): File location for the LA precincts shapefile.
+
+    Return:
+    extract (dict): Contents of the registered voters, votes cast and vote center 
+        csvs, and file locations of the scaled precinct shapefile, vote center 
+        geojson and allocations, as taken by replay_pipelines().
+    """
+    # each copy is shifted east by the width of LA
+    prec = gpd.read_file(precincts_shape)
+    width = prec.total_bounds[2] - prec.total_bounds[0]
+    def scale(df, prefix_cols={}, suffix_cols={}, id_cols=[], geometry=False):
+        frames = []
+        for copy in range(copies):
+            frame = df.copy()
+            if copy > 0:
+                # rows without a precinct number or address are only kept in the first copy
+                frame = frame.dropna(subset=list(prefix_cols))
+                for col, prefix in prefix_cols.items():
+                    frame[col] = prefix + str(copy) + frame[col]
+                for col in suffix_cols:
+                    frame[col] = frame[col] + ' S' + str(copy)
+                for col in id_cols:
+                    frame[col] = frame[col] + copy*1000000
+                if geometry:
+                    frame['geometry'] = frame.geometry.translate(xoff=copy*(width + 0.1))
+            frames.append(frame)
+        return pd.concat(frames, ignore_index=True)
+    csv = lambda df: df.to_csv(index=False).encode()
+    prec = gpd.GeoDataFrame(scale(prec, prefix_cols={'PRECINCT' : 'S'}, geometry=True), crs=prec.crs)
+    vc_gdf = gpd.read_file(votecenter_gjson)
+    vc_gdf = gpd.GeoDataFrame(scale(vc_gdf, prefix_cols={'Address' : 'S'}, suffix_cols=['Name'], 
+        id_cols=['Vote Location Id'], geometry=True), crs=vc_gdf.crs)
+    vc_alloc = scale(pd.read_excel(votecenter_alloc), id_cols=['vote_center_sos_id'])
+    extract = {
+        'registered_voters' : csv(scale(pd.read_csv(io.BytesIO(read_most_recent_bytes(registered_voters)), dtype=str), 
+            prefix_cols={'Voter Precinct Number' : 'S'})),
+        'voters' : csv(scale(pd.read_csv(io.BytesIO(read_most_recent_bytes(voters)), dtype=str), 
+            prefix_cols={'VPH HomePrecinct Number' : 'S'})),
+        'votecenter_voters' : csv(scale(pd.read_csv(io.BytesIO(read_most_recent_bytes(votecenter_voters)), dtype=str), 
+            prefix_cols={'Vote Location Address' : 'S'}, suffix_cols=['Vote Location Name'])),
+        'precincts_shape' : f'{scale_dir}/precincts.shp',
+        'votecenter_gjson' : f'{scale_dir}/vote_centers_locs.geojson',
+        'votecenter_alloc' : f'{scale_dir}/allocations.xlsx',
+    }
+    prec.to_file(extract['precincts_shape'])
+    vc_gdf.to_file(extract['votecenter_gjson'], driver='GeoJSON')
+    vc_alloc.to_excel(extract['votecenter_alloc'], index=False)
+    return extract
+
+def replay_pipelines(extract, passes=2):
+    """
+    Runs the precinct and vote center pipelines on an extract the way 
+    process_data.py does, in a temporary working directory so the map outputs, 
+    snapshot, caches and history in the repo are not touched. The first pass 
+    parses the csvs and simplifies the precinct geometry, later passes read them
+    from the cache. The output of the pipelines is not printed.
+
+    Args:
+    extract (dict): Contents of the registered voters, votes cast and vote center
+        csvs ('registered_voters', 'voters' and 'votecenter_voters'), and optionally 
+        file locations for the precinct shapefile, vote center geojson and 
+        allocations ('precincts_shape', 'votecenter_gjson' and 'votecenter_alloc').
+    passes (int): Number of times to run the pipelines (default 2).
+
+    Return:
+    stages (list): Stages recorded by instrumentation.stage(), with each pass 
+        named "cold" or "cached".
+    """
+    paths = {name : os.path.abspath(extract.get(name, default)) for name, default in [('precincts_shape', precincts_shape),
+        ('votecenter_gjson', votecenter_gjson), ('votecenter_alloc', votecenter_alloc), ('override_file', override_file)]}
+    repo = os.getcwd()
+    pop_stages()
+    with tempfile.TemporaryDirectory() as run_dir:
+        os.makedirs(f'{run_dir}/data/final_geojsons/precincts')
+        os.makedirs(f'{run_dir}/data/final_geojsons/vote_centers')
+        os.chdir(run_dir)
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                for run in range(passes):
+                    with stage('cold' if run == 0 else 'cached'):
+                        with stage('precincts'):
+                            process_precincts(paths['precincts_shape'], io.BytesIO(extract['registered_voters']), 
+                                io.BytesIO(extract['voters']), 'data/final_geojsons', extract='replay')
+                        with stage('vote centers'):
+                            process_votecenters(paths['votecenter_gjson'], io.BytesIO(extract['votecenter_voters']), 
+                                paths['votecenter_alloc'], 'data/final_geojsons', extract='replay', 
+                                override_file=paths['override_file'])
+        finally:
+            os.chdir(repo)
+    return pop_stages()
+
+def compare_runs(name, stages, threshold=1.25, min_seconds=0.5):
+    """
+    Saves the stages of a benchmark to a run log in data/runs/benchmarks and 
+    compares them with the last run log of the same benchmark, flagging stages 
+    that took longer than threshold times as long. Stages that took less than 
+    min_seconds both times are not flagged, their times are mostly noise.
+
+    Return:
+    regressions (list): Names of the stages flagged as slower.
+    """
+    logs = sorted(file for file in os.listdir(benchmark_runs) if file.endswith('.json')) if os.path.exists(benchmark_runs) else []
+    previous = None
+    for file in reversed(logs):
+        with open(f'{benchmark_runs}/{file}') as f:
+            run = json.load(f)
+        if run.get('benchmark') == name:
+            previous = {record['stage'] : record['seconds'] for record in run['stages']}
+            break
+    print('Run log written to', write_run_log(stages, benchmark_runs, benchmark=name))
+    if previous is None:
+        print('No previous run of', name, 'to compare with')
+        return []
+    regressions = []
+    print('Compared with', file + ':')
+    for record in stages:
+        before = previous.get(record['stage'])
+        if before is None:
+            continue
+        slower = record['seconds'] > threshold*before and max(record['seconds'], before) >= min_seconds
+        if slower:
+            regressions.append(record['stage'])
+        print('  %-44s %8.2fs -> %8.2fs%s' % (record['stage'], before, record['seconds'], '  SLOWER' if slower else ''))
+    return regressions
+
+def time_call(func, *args, repeat=1):
+    """
+    Times a function call, returning the best wall time in seconds over 
+    repeat calls and the result of the last call.
+    """
+    best = math.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+def peak_memory(func, *args):
+    """
+    Returns the peak memory in MB allocated by python while running a function call.
+    """
+    tracemalloc.start()
+    func(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak/1e6
+
+def bench_format_tooltips(repeat=3):
+    """
+    Times the row by row and vectorized tooltip formatting on the files in 
+    data/most_recent and checks that both produce identical strings.
+    """
+    df = precinct_counts()
+    old_time, old = time_call(format_tooltips_iterrows, df.copy())
+    new_time, new = time_call(lambda x: format_tooltips(x.copy()), df, repeat=repeat)
+    cols = ['Percent Votes Cast', 'Percent Mail', 'Percent Poll', 'Percent Drop Box', 
+            'Percent Vote Center Drop Off']
+    assert old[cols].equals(new[cols]), "Vectorized tooltips differ from row by row tooltips"
+    print('format_tooltips on', len(df), 'precincts')
+    print('  iterrows:   %.3fs' % old_time)
+    print('  vectorized: %.3fs (%.0fx faster)' % (new_time, old_time/new_time))
+
+def bench_aggregate_votes(repeat=3):
+    """
+    Times the filtered groupby and single pivot vote aggregations on the votes cast
+    csv in data/most_recent, read with read_votes() as process_precincts() reads it,
+    reports the peak memory of each and checks that both produce identical precinct 
+    and county totals.
+    """
+    vote = read_votes(io.BytesIO(read_most_recent_bytes(voters)))
+    old_time, (old, old_county) = time_call(aggregate_votes_groupbys, vote, repeat=repeat)
+    new_time, (new, new_county) = time_call(aggregate_votes, vote, repeat=repeat)
+    old = old.sort_values('PrecinctNumber', ignore_index=True)
+    pd.testing.assert_frame_equal(old[new.columns], new, check_dtype=False)
+    assert old_county.equals(new_county[old_county.index]), "County totals differ between aggregations"
+    print('aggregate_votes on', len(vote), 'rows')
+    print('  filtered groupbys: %.3fs, peak %.1f MB' % (old_time, peak_memory(aggregate_votes_groupbys, vote)))
+    print('  single pivot:      %.3fs, peak %.1f MB (%.1fx faster)' % (new_time, peak_memory(aggregate_votes, vote), old_time/new_time))
+
+def bench_read_votes(repeat=3):
+    """
+    Times the untyped read, the typed and column pruned read, and the read of the
+    cached Parquet copy of the votes cast csv in data/most_recent, and reports 
+    the memory used by the data each one returns.
+    """
+    contents = read_most_recent_bytes(voters)
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cache_file = cache_dir + '/votes.parquet'
+        old_time, old = time_call(lambda: read_votes_untyped(io.BytesIO(contents)), repeat=repeat)
+        new_time, new = time_call(lambda: read_votes(io.BytesIO(contents)), repeat=repeat)
+        read_votes(io.BytesIO(contents), cache_file=cache_file)
+        cached_time, cached = time_call(lambda: read_votes(None, cache_file=cache_file), repeat=repeat)
+    assert old['VPH HomePrecinct Number'].replace('nan', np.nan).equals(new['VPH HomePrecinct Number']), "Precinct numbers differ between reads"
+    assert old['# of Votes accepted'].sum() == new['# of Votes accepted'].sum(), "Votes differ between reads"
+    pd.testing.assert_frame_equal(new, cached)
+    memory = lambda df: df.memory_usage(deep=True).sum()/1e6
+    print('read_votes on', len(new), 'rows')
+    print('  untyped:        %.3fs, %.1f MB' % (old_time, memory(old)))
+    print('  typed:          %.3fs, %.1f MB (%.1fx faster)' % (new_time, memory(new), old_time/new_time))
+    print('  cached Parquet: %.3fs, %.1f MB (%.1fx faster)' % (cached_time, memory(cached), old_time/cached_time))
+
+def bench_consolidate_vote_centers(scales={'LA' : 1, 'statewide' : 30}, repeat=3):
+    """
+    Times the python function and drop_duplicates consolidation of vote centers 
+    that share an address on the LA vote centers and on 30 copies of them (about 
+    24,000 locations, for running statewide or on other counties' files), and
+    checks that both keep the same rows and totals.
+    """
+    for name, copies in scales.items():
+        vc_final = scaled_vote_centers(copies)
+        old_time, old = time_call(consolidate_vote_centers_lambda, vc_final, repeat=repeat)
+        new_time, new = time_call(consolidate_vote_centers, vc_final, repeat=repeat)
+        pd.testing.assert_frame_equal(pd.DataFrame(old[new.columns]), pd.DataFrame(new), check_dtype=False)
+        print('consolidate_vote_centers on', len(vc_final), 'vote centers (%s, %d addresses)' % (name, len(new)))
+        print('  python first:    %.3fs' % old_time)
+        print('  drop_duplicates: %.3fs (%.0fx faster)' % (new_time, old_time/new_time))
+
+def bench_round_gdf(precincts_shape=precincts_shape, repeat=3):
+    """
+    Times the per polygon and vectorized geometry rounding on the precinct 
+    shapefile and reports the size of the GeoJSON geometry each one produces.
+    """
+    if not os.path.exists(precincts_shape):
+        print('round_gdf skipped, precinct shapefile not found:', precincts_shape)
+        return
+    prec = gpd.read_file(precincts_shape)[['geometry']]
+    old_time, old = time_call(lambda x: round_gdf_per_polygon(x.copy()), prec, repeat=repeat)
+    new_time, new = time_call(lambda x: round_gdf(x.copy()), prec, repeat=repeat)
+    unrounded = (~prec.geometry.type.isin(['Polygon']) | (prec.geometry.interiors.str.len() > 0)).sum()
+    print('round_gdf on', len(prec), 'precincts (%d MultiPolygons or Polygons with holes)' % unrounded)
+    print('  per polygon: %.3fs, %.2f MB GeoJSON' % (old_time, len(old.to_json())/1e6))
+    print('  vectorized:  %.3fs, %.2f MB GeoJSON (%.1fx faster)' % (new_time, len(new.to_json())/1e6, old_time/new_time))
+
+def bench_topojson(precincts_shape=precincts_shape, places=6, repeat=3):
+    """
+    Compares the size and parse time of the GeoJSON and TopoJSON precinct outputs,
+    built from the precinct shapefile and the counts in data/most_recent the way
+    process_precincts writes them. Parse time is measured with python's json 
+    parser as a proxy for the browser.
+    """
+    if not os.path.exists(precincts_shape):
+        print('topojson skipped, precinct shapefile not found:', precincts_shape)
+        return
+    reg = read_registered_voters(io.BytesIO(read_most_recent_bytes(registered_voters)))
+    vote = read_votes(io.BytesIO(read_most_recent_bytes(voters)))
+    df = format_tooltips(merge_precinct_counts(reg, aggregate_votes(vote)[0]))
+    prec = round_gdf(gpd.read_file(precincts_shape), places=places)
+    prec['PRECINCT'] = prec['PRECINCT'].astype(str)
+    gdf = prec.merge(df, left_on='PRECINCT', right_on='precinct').drop(columns='PRECINCT')
+    outputs = {
+        'GeoJSON' : ''.join(geojson_chunks(gdf, 'la')),
+        'TopoJSON' : ''.join(topojson_chunks(gdf, 'la_topo', 'precincts', places=places)),
+    }
+    print('precinct outputs for', len(gdf), 'precincts')
+    base = None
+    for name, text in outputs.items():
+        parse, _ = time_call(json.loads, text[text.index('=') + 1:], repeat=repeat)
+        size = len(text.encode('utf-8'))
+        base = base or size
+        print('  %-9s %.2f MB (%3.0f%%), parsed in %.3fs' % (name + ':', size/1e6, size/base*100, parse))
+
+def check_js_percents(count=5000, seed=0):
+    """
+    Checks that joinPrecinctStats() in index.html, run with node, formats the 
+    percents of the split output exactly like format_tooltips() and computes the
+    same pctvote as process_precincts. Uses random counts and counts whose 
+    percents are on or within a rounding error of a tie (e.g. 1973/2000 is 98.65,
+    just above the tie, and 1/400 is 0.25, an exact tie).
+    """
+    if shutil.which('node') is None:
+        print('js_percents skipped, node not found')
+        return
+    rng = np.random.default_rng(seed)
+    active = np.concatenate([rng.integers(1, 5000, count), [2000]*5 + [400, 400, 4, 8, 40]])
+    total = np.concatenate([rng.integers(0, active[:count] + 1), [1973, 3633, 9, 49, 4121, 1, 3, 1, 5, 1]])
+    mail = rng.integers(0, total + 1)
+    drop_box = rng.integers(0, total - mail + 1)
+    poll = rng.integers(0, total - mail - drop_box + 1)
+    df = pd.DataFrame({
+        'precinct' : ['P%05d' % i for i in range(len(total))],
+        'Number of Active Voters' : active, 'Total Votes' : total, 'Mail' : mail, 'Drop Box' : drop_box, 
+        'Vote Center Drop Off' : total - mail - drop_box - poll, 'In Person Live Ballot' : poll,
+        'Conditional Voter Registration' : rng.integers(0, total + 1),
+    })
+    expected = format_tooltips(df.copy())
+    expected['pctvote'] = round((df['Total Votes']/df['Number of Active Voters'])*100, 1)
+    with open('index.html') as f:
+        html = f.read()
+    # cut joinPrecinctStats() out of index.html by matching its braces
+    start = html.index('function joinPrecinctStats(')
+    depth, end = 0, html.index('{', start)
+    while True:
+        depth += {'{' : 1, '}' : -1}.get(html[end], 0)
+        if depth == 0:
+            break
+        end += 1
+    with tempfile.TemporaryDirectory() as check_dir:
+        write_stats_js(df, df[COUNT_COLS].sum(), '', 'la_stats', f'{check_dir}/stats.js', f'{check_dir}/stats_archive.js')
+        shapes = {'features' : [{'properties' : {'precinct' : precinct}, 'geometry' : None} for precinct in df['precinct']]}
+        with open(f'{check_dir}/check.js', 'w') as f:
+            f.write(html[start:end + 1] + '\n' + open(f'{check_dir}/stats.js').read() + 
+                'console.log(JSON.stringify(joinPrecinctStats(' + json.dumps(shapes) + ', la_stats).features.map(function(feature) { return feature.properties; })));\n')
+        output = subprocess.run(['node', f'{check_dir}/check.js'], capture_output=True, text=True, check=True).stdout
+    props = pd.DataFrame(json.loads(output)[:len(df)])
+    cols = ['Percent Votes Cast', 'Percent Mail', 'Percent Poll', 'Percent Drop Box', 'Percent Vote Center Drop Off', 'pctvote']
+    mismatched = (props[cols] != expected[cols]).any(axis=1)
+    print('js percents on', len(df), 'precincts:', mismatched.sum(), 'differ from python')
+    assert not mismatched.any(), 'joinPrecinctStats() differs from python:\n' + str(
+        pd.concat([props.loc[mismatched, cols], expected.loc[mismatched, cols]], keys=['js', 'python'], axis=1).head())
+
+def bench_replay(precincts_shape=precincts_shape):
+    """
+    Replays the most recent extract in data/most_recent through both pipelines 
+    with replay_pipelines(), once cold and once from the cache, reports the time,
+    rows and memory of every stage and compares them with the previous replay.
+    """
+    if not os.path.exists(precincts_shape):
+        print('replay skipped, precinct shapefile not found:', precincts_shape)
+        return []
+    extract = {name : read_most_recent_bytes(filename) for name, filename in 
+        [('registered_voters', registered_voters), ('voters', voters), ('votecenter_voters', votecenter_voters)]}
+    extract['precincts_shape'] = precincts_shape
+    stages = replay_pipelines(extract)
+    print('replay of the most recent extract in', data_folder)
+    print_stages(stages)
+    return compare_runs('replay', stages)
+
+def bench_statewide(copies=4, precincts_shape=precincts_shape):
+    """
+    Runs both pipelines on 4 copies of the most recent extract with 
+    scaled_extract() and replay_pipelines(), about the number of precincts and 
+    vote centers statewide (LA has about a quarter of California's voters), 
+    reports the time, rows and memory of every stage and compares them with the 
+    previous statewide run.
+    """
+    if not os.path.exists(precincts_shape):
+        print('statewide skipped, precinct shapefile not found:', precincts_shape)
+        return []
+    with tempfile.TemporaryDirectory() as scale_dir:
+        stages = replay_pipelines(scaled_extract(copies, scale_dir, precincts_shape))
+    print('statewide scale-up,', copies, 'copies of the most recent extract in', data_folder)
+    print_stages(stages)
+    return compare_runs('statewide', stages)
+
+if __name__ == '__main__':
+    benchmarks = {
+        'format_tooltips' : bench_format_tooltips,
+        'aggregate_votes' : bench_aggregate_votes,
+        'read_votes' : bench_read_votes,
+        'consolidate_vote_centers' : bench_consolidate_vote_centers,
+        'round_gdf' : bench_round_gdf,
+        'topojson' : bench_topojson,
+        'js_percents' : check_js_percents,
+        'replay' : bench_replay,
+        'statewide' : bench_statewide,
+    }
+    names = sys.argv[1:] or list(benchmarks)
+    regressions = []
+    for name in names:
+        regressions += benchmarks[name]() or []
+    # exit with an error if the pipeline benchmarks got slower, so they can gate a change
+    if regressions:
+        print('Slower than the previous run:', ', '.join(regressions))
+        sys.exit(1)
@@ -0,0 +1,120 @@
+import os
+import pandas as pd
+
+# format of the registrar's 'Date/Time Extract Run' (e.g. "2020-12-08 08:45:23.963")
+EXTRACT_TIME_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+
+def in_history(kind, extract, history_dir='data/history'):
+    """
+    Whether the counts of a kind from an extract are already in the history store.
+    """
+    return os.path.exists(f'{history_dir}/{kind}/{extract}.parquet')
+
+def append_history(df, kind, extract, date_time, history_dir='data/history'):
+    """
+    Adds the counts from one extract to the history store, a directory of Parquet
+    files per kind of counts with one file per extract (e.g.
+    "data/history/precincts/12082020_900am.parquet"). Files are never rewritten,
+    so an extract that is already in the store is skipped.
+
+    Args:
+    df (pandas dataframe): Counts from the extract.
+    kind (str): Kind of counts (e.g. "precincts" or "vote_centers").
+    extract (str): Name of the extract zip file without its extension (e.g. "12082020_900am").
+    date_time (str): Date and time of the data extract (e.g. "2020-12-08 08:45:23.963"),
+        na if it can't be read.
+    history_dir (str): Directory location for the history store (default "data/history").
+
+    Return:
+    added (bool): Whether the extract was added to the store.
+    """
+    if in_history(kind, extract, history_dir):
+        return False
+    history_file = f'{history_dir}/{kind}/{extract}.parquet'
+    df = df.assign(**{'extract' : extract, 'Date/Time' : pd.to_datetime(date_time, format=EXTRACT_TIME_FORMAT, errors='coerce')})
+    os.makedirs(os.path.dirname(history_file), exist_ok=True)
+    df.to_parquet(history_file + '.tmp', index=False)
+    os.replace(history_file + '.tmp', history_file)
+    return True
+
+def read_history(kind, history_dir='data/history', filters=None):
+    """
+    Reads the counts of a kind from every extract in the history store, only
+    reading the rows that match the filters from each file.
+
+    Args:
+    kind (str): Kind of counts (e.g. "precincts" or "vote_centers").
+    history_dir (str): Directory location for the history store (default "data/history").
+    filters (list): Pyarrow filters on the rows to read (e.g. [('precinct', '==', '0050001B')]).
+
+    Return:
+    df (pandas dataframe): Counts sorted by extract date and time.
+    """
+    kind_dir = f'{history_dir}/{kind}'
+    if not os.path.exists(kind_dir) or not any(file.endswith('.parquet') for file in os.listdir(kind_dir)):
+        return pd.DataFrame()
+    df = pd.read_parquet(kind_dir, filters=filters)
+    return df.sort_values(['Date/Time', 'extract'], ignore_index=True)
+
+def precinct_turnout(precinct, history_dir='data/history'):
+    """
+    Turnout curve for a precinct, its counts and percent of registered voters
+    casting ballots in every extract. Use 'Los Angeles' for the county totals.
+
+    Args:
+    precinct (str): Precinct number (e.g. "0050001B").
+    history_dir (str): Directory location for the history store (default "data/history").
+
+    Return:
+    df (pandas dataframe): Counts and 'pctvote' by extract.
+    """
+    df = read_history('precincts', history_dir, filters=[('precinct', '==', precinct)])
+    if len(df) > 0:
+        df['pctvote'] = (df['Total Votes']/df['Number of Active Voters'].where(df['Number of Active Voters'] > 0))*100
+    return df
+
+def vote_center_turnout(name, history_dir='data/history'):
+    """
+    In-person votes accepted at a vote center in every extract.
+
+    Args:
+    name (str): Name of the vote center in the vote center geojson.
+    history_dir (str): Directory location for the history store (default "data/history").
+
+    Return:
+    df (pandas dataframe): Votes accepted by extract.
+    """
+    return read_history('vote_centers', history_dir, filters=[('Vote Location Name', '==', name)])
+
+def county_deltas(history_dir='data/history'):
+    """
+    County level totals in every extract and the change in each since the
+    previous extract.
+
+    Args:
+    history_dir (str): Directory location for the history store (default "data/history").
+
+    Return:
+    df (pandas dataframe): County totals by extract, with the changes in columns
+        suffixed with " Change".
+    """
+    df = precinct_turnout('Los Angeles', history_dir)
+    if len(df) == 0:
+        return df
+    cols = [col for col in df.columns if col not in ['precinct', 'extract', 'Date/Time', 'pctvote']]
+    return df.join(df[cols].diff().add_suffix(' Change'))
+
+def read_county_summary(summary_file='data/county_level_summary.csv'):
+    """
+    Reads the county level summary saved by each run, with dates and times that
+    can't be read (e.g. "27:56.4") as na.
+
+    Args:
+    summary_file (str): File location for the summary (default "data/county_level_summary.csv").
+
+    Return:
+    df (pandas dataframe): County level summary with 'Date/Time' as datetimes.
+    """
+    df = pd.read_csv(summary_file)
+    df['Date/Time'] = pd.to_datetime(df['Date/Time'], format=EXTRACT_TIME_FORMAT, errors='coerce')
+    return df
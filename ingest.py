@@ -0,0 +1,102 @@
+import os
+import numpy as np
+import pandas as pd
+
+# columns read from each registrar csv and their dtypes, all other columns are skipped
+REGISTERED_VOTERS_DTYPES = {
+    'Voter Precinct Number' : 'str',
+    '# of Active Voters' : 'int32',
+}
+VOTES_DTYPES = {
+    'VPH HomePrecinct Number' : 'str',
+    'VBM Return Method Code' : 'category',
+    'Voting Type' : 'category',
+    '# of Votes accepted' : 'int32',
+    'Date/Time Extract Run' : 'category',
+}
+VOTE_CENTER_VOTES_DTYPES = {
+    'Vote Location Name' : 'str',
+    'Vote Location Address' : 'str',
+    '# of Votes accepted' : 'int32',
+    'Date/Time Extract Run' : 'category',
+}
+
+def normalize_precincts(precincts):
+    """
+    Removes the punctuation from precinct numbers so they match the precinct
+    shapefile (e.g. "0050001.B" to "0050001B"). Precinct numbers that are na
+    stay na.
+
+    Args:
+    precincts (pandas series): Precinct numbers as strings.
+
+    Return:
+    precincts (pandas series): Precinct numbers without "." or "-".
+    """
+    # normalize each distinct precinct number once since the csvs repeat them on many 
+    # rows, nas are coded -1 and take the na appended at the end
+    codes, uniques = pd.factorize(precincts)
+    normalized = np.append(uniques.str.replace(r'[.-]', '', regex=True).to_numpy(dtype=object), np.nan)
+    return pd.Series(normalized[codes], index=precincts.index, name=precincts.name)
+
+def read_extract(csv, dtypes, precinct_col=None, cache_file=None):
+    """
+    Reads the specified columns of a registrar csv with compact dtypes, normalizing
+    the precinct numbers if there are any. The parsed data is saved as Parquet so
+    later runs on the same extract skip parsing the csv.
+
+    Args:
+    csv (str or file): File location or open file for the csv.
+    dtypes (dict): Dtype of each column to read.
+    precinct_col (str): Name of the precinct number column to normalize (default None).
+    cache_file (str): File location for the Parquet copy of the parsed csv,
+        which is read instead of the csv if it exists (default None, no caching).
+
+    Return:
+    df (pandas dataframe): Parsed csv with only the specified columns.
+    """
+    if cache_file is not None and os.path.exists(cache_file):
+        return pd.read_parquet(cache_file)
+    df = pd.read_csv(csv, usecols=list(dtypes), dtype=dtypes)
+    if precinct_col is not None:
+        df[precinct_col] = normalize_precincts(df[precinct_col])
+    if cache_file is not None:
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        df.to_parquet(cache_file + '.tmp', index=False)
+        os.replace(cache_file + '.tmp', cache_file)
+    return df
+
+def extract_cache_file(cache_dir, extract, name):
+    """
+    File location for the Parquet copy of a csv from an extract, or None if
+    the extract is not known.
+
+    Args:
+    cache_dir (str): Directory location for cached data (e.g. "data/cache").
+    extract (str): Name of the extract zip file without its extension (e.g. "12082020_900am").
+    name (str): Name of the csv (e.g. "votes").
+    """
+    if extract is None:
+        return None
+    return f'{cache_dir}/extracts/{extract}/{name}.parquet'
+
+def read_registered_voters(csv, cache_file=None):
+    """
+    Reads the registered voters by precinct csv
+    (filename: "1- Count of registered voters by precinct.csv").
+    """
+    return read_extract(csv, REGISTERED_VOTERS_DTYPES, precinct_col='Voter Precinct Number', cache_file=cache_file)
+
+def read_votes(csv, cache_file=None):
+    """
+    Reads the votes cast by precinct csv
+    (filename: "2- Count of votes cast (broken out by VBM and in-person ballots) by precinct and VBM return method.csv").
+    """
+    return read_extract(csv, VOTES_DTYPES, precinct_col='VPH HomePrecinct Number', cache_file=cache_file)
+
+def read_vote_center_votes(csv, cache_file=None):
+    """
+    Reads the in-person votes cast by vote center csv
+    (filename: "3- Count of in-person ballots cast for each vote center with VBM return method_LA.csv").
+    """
+    return read_extract(csv, VOTE_CENTER_VOTES_DTYPES, cache_file=cache_file)
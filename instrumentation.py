@@ -0,0 +1,175 @@
+import os
+import sys
+import json
+import time
+import cProfile
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+try:
+    import resource
+except ImportError:
+    # not available on windows, peak rss is recorded as na
+    resource = None
+
+# stages recorded in this process since pop_stages() was last called
+_stages = []
+# frames of the stages that are currently open, innermost last
+_open = []
+# 'cprofile', 'tracemalloc' or None, and where their dumps are written, set by configure()
+_profile = None
+_profile_dir = 'data/profiles'
+
+def configure(profile=None, profile_dir='data/profiles'):
+    """
+    Turns on profiling of the pipeline stages in this process. With 'cprofile'
+    each outermost stage is run under cProfile and its stats are dumped to
+    "{profile_dir}/{stage}.prof" (open with pstats or snakeviz). With 'tracemalloc'
+    every stage records the peak memory allocated by python while it ran and the
+    lines holding the most memory at the end of each stage are written to
+    "{profile_dir}/{stage}.txt", named by the outermost stage. Both slow the 
+    pipelines down, tracemalloc by several times, so they are off by default.
+
+    Args:
+    profile (str): 'cprofile', 'tracemalloc' or None to turn profiling off (default None).
+    profile_dir (str): Directory location for the profile dumps (default "data/profiles").
+    """
+    global _profile, _profile_dir
+    if profile not in [None, 'cprofile', 'tracemalloc']:
+        raise ValueError('profile must be "cprofile", "tracemalloc" or None, not %r' % profile)
+    _profile = profile
+    _profile_dir = profile_dir
+
+def peak_rss():
+    """
+    Peak resident set size of this process so far in MB, or None where the
+    resource module is not available.
+    """
+    if resource is None:
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on macos
+    return round(maxrss/(1e6 if sys.platform == 'darwin' else 1e3), 1)
+
+@contextmanager
+def stage(name, rows=None):
+    """
+    Records the wall time, the peak resident set size of the process at the end
+    and the number of rows handled by a pipeline stage. Stages can be nested and
+    are named by the stages they are in (e.g. "precincts/read geometry/simplify"),
+    the time of a nested stage is also counted in the stages it is in. The number
+    of rows can be given up front or set on the yielded record once it is known:
+
+        with stage('aggregate') as record:
+            df = aggregate(vote)
+            record['rows'] = len(df)
+
+    Args:
+    name (str): Name of the stage (e.g. "read", "aggregate" or "serialize").
+    rows (int): Number of rows handled by the stage (default None).
+
+    Return:
+    record (dict): Record of the stage, returned by pop_stages() with its time
+        and memory filled in once the stage ends, and the 'error' if it raises.
+    """
+    record = {'stage' : '/'.join([frame['record']['stage'] for frame in _open[-1:]] + [name]), 'rows' : rows}
+    outermost = len(_open) == 0
+    # profile dumps are named by the outermost stage, which nested stages add to
+    dump = f'{_profile_dir}/{record["stage"].replace(" ", "_")}' if outermost else _open[-1]['dump']
+    frame = {'record' : record, 'dump' : dump, 'traced_peak' : 0}
+    profiler = None
+    if _profile is not None and outermost:
+        os.makedirs(_profile_dir, exist_ok=True)
+    if _profile == 'cprofile' and outermost:
+        profiler = cProfile.Profile()
+    elif _profile == 'tracemalloc':
+        if outermost:
+            tracemalloc.start()
+            open(dump + '.txt', 'w').close()
+        else:
+            # the peak is global, so carry the enclosing stage's peak so far before resetting it
+            _open[-1]['traced_peak'] = max(_open[-1]['traced_peak'], tracemalloc.get_traced_memory()[1])
+        tracemalloc.reset_peak()
+    _open.append(frame)
+    _stages.append(record)
+    start = time.perf_counter()
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield record
+    except BaseException as error:
+        # mark the stage that failed, and the stages it is in, in the run log
+        record['error'] = f'{type(error).__name__}: {error}'
+        raise
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(dump + '.prof')
+        record['seconds'] = round(time.perf_counter() - start, 4)
+        record['peak_rss_mb'] = peak_rss()
+        _open.pop()
+        if _profile == 'tracemalloc' and tracemalloc.is_tracing():
+            traced_peak = max(frame['traced_peak'], tracemalloc.get_traced_memory()[1])
+            record['traced_peak_mb'] = round(traced_peak/1e6, 1)
+            # list the lines holding the most memory at the end of the stage, while the 
+            # data of the stages it is in is still held
+            snapshot = tracemalloc.take_snapshot().filter_traces([
+                tracemalloc.Filter(False, '<frozen importlib._bootstrap*>'),
+                tracemalloc.Filter(False, tracemalloc.__file__),
+            ])
+            with open(dump + '.txt', 'a') as f:
+                f.write(f'{record["stage"]}: peak {record["traced_peak_mb"]} MB allocated by python, held at the end:\n')
+                for stat in snapshot.statistics('lineno')[:10]:
+                    f.write(f'  {stat}\n')
+            if outermost:
+                tracemalloc.stop()
+            else:
+                _open[-1]['traced_peak'] = max(_open[-1]['traced_peak'], traced_peak)
+                tracemalloc.reset_peak()
+
+def pop_stages():
+    """
+    Returns the stages recorded in this process in the order they started and
+    clears them, so a worker process can send back the stages of each task.
+
+    Return:
+    stages (list): Stage records with 'stage', 'rows', 'seconds' and 'peak_rss_mb',
+        'traced_peak_mb' if profiling with tracemalloc and 'error' if the stage failed.
+    """
+    stages = list(_stages)
+    _stages.clear()
+    return stages
+
+def write_run_log(stages, log_dir='data/runs', **run):
+    """
+    Writes the stages of a run to a JSON run log named by the time it is written
+    (e.g. "data/runs/run_20201208_091502.json"), so the stage timings and memory of
+    runs can be compared over time.
+
+    Args:
+    stages (list): Stage records from pop_stages().
+    log_dir (str): Directory location for the run logs (default "data/runs").
+    **run: Details of the run saved with the stages (e.g. extract="12082020_900am").
+
+    Return:
+    log_file (str): File location of the run log.
+    """
+    now = datetime.now()
+    log_file = f'{log_dir}/run_{now.strftime("%Y%m%d_%H%M%S")}.json'
+    os.makedirs(log_dir, exist_ok=True)
+    with open(log_file, 'w') as f:
+        json.dump({'logged' : now.isoformat(timespec='seconds'), **run, 'stages' : stages}, f, indent=1)
+    return log_file
+
+def print_stages(stages):
+    """
+    Prints the wall time, rows and peak memory of each stage, indented by how
+    deeply the stage is nested.
+    """
+    megabytes = lambda mb: '' if mb is None else '%.0f' % mb
+    print('%-36s %8s %10s %8s %9s' % ('stage', 'seconds', 'rows', 'rss MB', 'python MB'))
+    for record in stages:
+        name = '  '*record['stage'].count('/') + record['stage'].split('/')[-1] + (' FAILED' if 'error' in record else '')
+        rows = '' if record.get('rows') is None else '{:,}'.format(record['rows'])
+        print('%-36s %8.2f %10s %8s %9s' % (name, record['seconds'], rows, 
+            megabytes(record.get('peak_rss_mb')), megabytes(record.get('traced_peak_mb'))))
@@ -1,10 +1,30 @@
 import geopandas as gpd
 import pandas as pd
 import numpy as np
-import math
 import os 
+import hashlib
+import filecmp
+import json
+import time
+import shutil
 from datetime import date, datetime
-from shapely.geometry import Point, Polygon
+import shapely
+from shapely.geometry import Point
+from topology import build_topology
+from tiles import write_tile_pyramid
+from ingest import read_registered_voters, read_votes, read_vote_center_votes, extract_cache_file
+from matching import read_overrides, match_vote_centers, report_matches
+from history import in_history, append_history, read_county_summary
+from instrumentation import stage
+
+# bump when the way cached precinct geometry is simplified or rounded changes
+GEOMETRY_CACHE_VERSION = 2
+
+# precinct counts saved between runs to find the precincts that changed
+COUNT_COLS = ['Number of Active Voters', 'Total Votes', 'Mail', 'Drop Box', 'Vote Center Drop Off', 
+    'In Person Live Ballot', 'Conditional Voter Registration']
+# columns summed across vote centers that share an address
+VC_SUM_COLS = ['# of Votes accepted', 'bmd_allocated', 'ePollBook_Allocated']
 
 def round_gdf(gdf, places=6, tolerance=0.0000005):
     """
@@ -26,113 +46,635 @@ def round_gdf(gdf, places=6, tolerance=0.0000005):
     if tolerance > 0:
         gdf['geometry'] = gdf.geometry.simplify(tolerance)
     if places > 0:
-        gdf['geometry'] = gdf.geometry.map(lambda x: round_polygon(x, places=places))
+        gdf['geometry'] = gpd.GeoSeries(round_polygon(np.asarray(gdf.geometry.values), places=places), 
+            index=gdf.index, crs=gdf.crs)
     return gdf
 
 def round_polygon(polygon, places=6):
     """
-    Takes in a polygon and rounds coordinates to the specified 
-    number of decimal places. Outputs the reduced polygon.
+    Takes in a polygon, or an array of geometries, and rounds coordinates to the 
+    specified number of decimal places. Outputs the reduced polygon. Rounds the 
+    flat array of all coordinates at once, so it handles holes, MultiPolygons and
+    every other geometry type.
 
     Args:
-    polygon (shapely polygon): Shapely polygon to be reduced.
+    polygon (shapely polygon or numpy array): Shapely geometry, or array of 
+        shapely geometries, to be reduced.
     places (int): Number of decimal places to round to (default is 6, .01m accuracy).
         Set to 0 if not rounding.
 
     Return:
-    polygon (shapely polygon): Shapely polygon with reduced size.
+    polygon (shapely polygon or numpy array): Shapely geometry, or array of 
+        shapely geometries, with reduced size.
     """
-    if (polygon.type == 'Polygon' and polygon.length == polygon.exterior.length): # Only handling easy cases, which are 99.9% of them anyway
-        rounded_coords = [[round(coord,places) for coord in x] for x in polygon.exterior.coords]
-        return Polygon(rounded_coords)
-    else:
-        return polygon
+    return shapely.transform(polygon, lambda coords: np.round(coords, places))
+
+def geometry_cache_key(precincts_shape, places=6, tolerance=0.0000005):
+    """
+    Key of the simplified and rounded precinct geometry, a hash of every file that 
+    makes up the shapefile along with the places and tolerance used.
+
+    Args:
+    precincts_shape (str): File location for precincts shapefile
+        (filename: "registrar_precincts_4326.shp").
+    places (int): Number of decimal places to round to (default is 6, .01m accuracy).
+    tolerance (flt): Tolerance level (default is 0.0000005, a .01m accuracy).
+
+    Return:
+    key (str): Hex digest of the shapefile and reduction parameters.
+    """
+    stem = os.path.splitext(precincts_shape)[0]
+    key = hashlib.sha256(f'{GEOMETRY_CACHE_VERSION}:{places}:{tolerance}'.encode())
+    for ext in ['.shp', '.shx', '.dbf', '.prj', '.cpg']:
+        if os.path.exists(stem + ext):
+            with open(stem + ext, 'rb') as f:
+                key.update(f.read())
+    return key.hexdigest()[:16]
+
+def load_precinct_geometry(precincts_shape, places=6, tolerance=0.0000005, cache_dir='data/cache', key=None):
+    """
+    Reads the precincts shapefile and simplifies and rounds its geometry with 
+    round_gdf(), caching the result as GeoParquet. The cache is keyed on 
+    geometry_cache_key(), a hash of the shapefile contents and the places and 
+    tolerance used, so later runs read the cached geometry instead of re-reading
+    and re-simplifying the shapefile.
+
+    Args:
+    precincts_shape (str): File location for precincts shapefile
+        (filename: "registrar_precincts_4326.shp").
+    places (int): Number of decimal places to round to (default is 6, .01m accuracy).
+        Set to 0 if not rounding.
+    tolerance (flt): Tolerance level (default is 0.0000005, a .01m accuracy)
+        Set to 0 if not simplifying.
+    cache_dir (str): Directory location for cached geometry (default "data/cache").
+    key (str): Key from geometry_cache_key() if it has already been computed (default None).
+
+    Return:
+    prec (geopandas dataframe): Precinct geometry with 'PRECINCT' as a string.
+    """
+    if key is None:
+        key = geometry_cache_key(precincts_shape, places=places, tolerance=tolerance)
+    cache = f'{cache_dir}/precincts_{key}.parquet'
+    if os.path.exists(cache):
+        return gpd.read_parquet(cache)
+    prec = gpd.read_file(precincts_shape)
+    prec['PRECINCT'] = prec['PRECINCT'].astype(str)
+    with stage('simplify', rows=len(prec)):
+        prec = round_gdf(prec, places=places, tolerance=tolerance)
+    # write to a temporary file first so an interrupted run can't leave a truncated cache
+    os.makedirs(cache_dir, exist_ok=True)
+    prec.to_parquet(cache + '.tmp', index=False)
+    os.replace(cache + '.tmp', cache)
+    return prec
+
+def format_tooltips(df):
+    """
+    Takes in a dataframe of precinct voting data and adds the hardcoded tooltip
+    columns with the percent rounded to one decimal and the total (e.g. "33.1% (4)").
+    Percents of total votes are out of registered voters and all other percents 
+    are out of total votes, with 'n/a' where there is nothing to divide by. 
+    Formats every precinct at once using numpy string operations.
+
+    Args:
+    df (pandas dataframe): Precinct voting data with 'Number of Active Voters', 
+        'Total Votes', 'Mail', 'In Person Live Ballot', 'Drop Box' and 
+        'Vote Center Drop Off' columns, with nas filled with 0s.
+
+    Return:
+    df (pandas dataframe): Precinct voting data with 'Percent Votes Cast', 
+        'Percent Mail', 'Percent Poll', 'Percent Drop Box' and 
+        'Percent Vote Center Drop Off' columns added.
+    """
+    cols = ['Total Votes', 'Mail', 'In Person Live Ballot', 'Drop Box', 'Vote Center Drop Off']
+    new_cols = ['Percent Votes Cast', 'Percent Mail', 'Percent Poll', 'Percent Drop Box', 
+                'Percent Vote Center Drop Off']
+    active = df['Number of Active Voters'].to_numpy(dtype='float64')
+    total = df['Total Votes'].to_numpy(dtype='float64')
+    for col, new_col in zip(cols, new_cols):
+        counts = df[col].to_numpy(dtype='float64')
+        with np.errstate(divide='ignore', invalid='ignore'):
+            pct = np.where(total > 0, (counts/total)*100, np.nan)
+            if col == 'Total Votes':
+                pct = np.where(active > 0, (counts/active)*100, pct)
+        # '%.1f' rounds half to even on the exact binary value like round(x, 1), 
+        # so the strings match str(round(x, 1)) for percents
+        text = np.char.mod('%.1f', pct).astype(object) + '%'
+        if col != 'Total Votes':
+            text = text + ' (' + counts.astype('int64').astype(str).astype(object) + ')'
+        df[new_col] = np.where(np.isnan(pct), 'n/a', text)
+    return df
+
+def aggregate_votes(vote):
+    """
+    Takes in the votes cast data and sums the number of votes accepted by precinct
+    for each VBM return method and voting type shown on the map. The data is scanned
+    once into precinct by VBM return method and voting type pivots, and both the 
+    precinct level and county level totals are taken from them.
+
+    Args:
+    vote (pandas dataframe): Votes cast data 
+        (filename: "2- Count of votes cast (broken out by VBM and in-person ballots) by precinct.csv")
+
+    Return:
+    join (pandas dataframe): Votes by precinct with 'PrecinctNumber', 'Mail', 'Drop Box', 
+        'Vote Center Drop Off', 'In Person Live Ballot', 'Conditional Voter Registration'
+        and 'Total Votes' columns, sorted by precinct number.
+    county (pandas series): County level totals of the same vote columns, including 
+        votes without a precinct number.
+    """
+    # code each row by precinct, with nas coded -1, and use the int8 codes of the
+    # categorical VBM return method and voting type columns from read_votes()
+    precincts, precinct_ids = pd.factorize(vote['VPH HomePrecinct Number'], sort=True)
+    votes = vote['# of Votes accepted'].to_numpy()
+    # one int32 buffer holds the pivot cell of each row for both pivots
+    keys = np.empty(len(vote), dtype='int32')
+    pivots = []
+    for col in ['VBM Return Method Code', 'Voting Type']:
+        codes = vote[col] if isinstance(vote[col].dtype, pd.CategoricalDtype) else vote[col].astype('category')
+        ids = codes.cat.categories
+        codes = codes.cat.codes.to_numpy()
+        # shift the codes up by one so nas get the first row and column and still
+        # count towards the totals
+        np.add(precincts, 1, out=keys, casting='unsafe')
+        keys *= len(ids) + 1
+        keys += codes
+        keys += 1
+        # sum votes into a precinct x return method or precinct x voting type pivot,
+        # with a plain range index so the columns are picked out without aligning
+        pivot = np.bincount(keys, weights=votes, minlength=(len(precinct_ids) + 1)*(len(ids) + 1))
+        pivots.append(pd.DataFrame(pivot.reshape(len(precinct_ids) + 1, len(ids) + 1).astype('int64'), 
+            columns=[np.nan] + list(ids)))
+    del precincts, keys
+    by_method, by_type = pivots
+    pivot = pd.DataFrame({
+        'Mail' : by_method.get('Mail', 0),
+        'Drop Box' : by_method.get('Drop Box', 0),
+        'Vote Center Drop Off' : by_method.get('Vote Center Drop Off', 0),
+        'In Person Live Ballot' : by_type.get('In Person Live Ballot', 0),
+        'Conditional Voter Registration' : by_type.get('CVR', 0),
+        'Total Votes' : by_type.sum(axis=1),
+    })
+    county = pivot.sum()
+    # drop the row of votes without a precinct number
+    join = pivot.iloc[1:].reset_index(drop=True)
+    join.insert(0, 'PrecinctNumber', precinct_ids)
+    return join, county
+
+def merge_precinct_counts(reg, join):
+    """
+    Merges the registered voters by precinct with the votes by precinct from 
+    aggregate_votes(), keeping precincts that only appear in one of them.
+
+    Args:
+    reg (pandas dataframe): Registered voter data from read_registered_voters().
+    join (pandas dataframe): Votes by precinct from aggregate_votes().
+
+    Return:
+    df (pandas dataframe): 'precinct' and COUNT_COLS by precinct, with nas filled with 0s.
+    """
+    df = reg.merge(join, left_on='Voter Precinct Number', right_on='PrecinctNumber', how='outer', suffixes=(None, '_voter'), validate='1:1')
+    df.rename(columns = {'# of Active Voters' : 'Number of Active Voters'},inplace=True)
+    # fill registered voter precinct number with voting data precinct number 
+    df['precinct'] = np.where(df['PrecinctNumber'].notnull(), df['PrecinctNumber'], df['Voter Precinct Number'])
+    df.drop(columns=['PrecinctNumber', 'Voter Precinct Number'], inplace=True)
+    # fill nas with 0s in registered voter and voter cols
+    for col in COUNT_COLS:
+        df[col] = df[col].fillna(0)
+    return df
+
+def county_counts(county, total_reg):
+    """
+    County level totals as a 'Los Angeles' row with the same columns as 
+    merge_precinct_counts().
+
+    Args:
+    county (pandas series): County level vote totals from aggregate_votes().
+    total_reg (int): Total number of registered voters.
+
+    Return:
+    df (pandas dataframe): County level totals.
+    """
+    return pd.DataFrame([{**county[COUNT_COLS[1:]].to_dict(), 'precinct' : 'Los Angeles', 'Number of Active Voters' : total_reg}])
+
+def sum_vote_centers(vc, vc_gdf, overrides=None):
+    """
+    Sums the in-person votes accepted by vote center across all days and matches 
+    the voting data vote center names to the geojson names with match_vote_centers().
+
+    Args:
+    vc (pandas dataframe): Vote center voting data from read_vote_center_votes().
+    vc_gdf (geopandas dataframe): Vote center geojson.
+    overrides (dict): Manual name matches from read_overrides() (default none).
+
+    Return:
+    vc (pandas dataframe): Votes accepted by vote center, with 'Vote Location Name' 
+        set to the matched geojson name where there is one.
+    matches (pandas dataframe): Matches from match_vote_centers().
+    """
+    vc = vc.groupby(['Vote Location Name', 'Vote Location Address'], as_index=False)['# of Votes accepted'].sum()
+    matches = match_vote_centers(vc, vc_gdf, overrides=overrides)
+    vc['Vote Location Name'] = matches['Name'].fillna(vc['Vote Location Name'])
+    return vc, matches
+
+def diff_precincts(previous, current):
+    """
+    Compares the precinct counts saved by the previous run with the current counts 
+    and reports the change in each count for every precinct that changed. The 
+    county totals are compared as the 'Los Angeles' row.
+
+    Args:
+    previous (pandas dataframe): Snapshot of precinct counts from the previous run.
+    current (pandas dataframe): Snapshot of precinct counts from the current run.
+
+    Return:
+    changes (pandas dataframe): The change in each count by precinct with a 
+        'status' column of 'new', 'removed' or 'changed', only including 
+        precincts where a count changed.
+    """
+    previous = previous.drop_duplicates('precinct').set_index('precinct')[COUNT_COLS]
+    current = current.drop_duplicates('precinct').set_index('precinct')[COUNT_COLS]
+    changes = current.sub(previous, fill_value=0).astype('int64')
+    changes.insert(0, 'status', 'changed')
+    changes.loc[~changes.index.isin(previous.index), 'status'] = 'new'
+    changes.loc[~changes.index.isin(current.index), 'status'] = 'removed'
+    changed = (changes[COUNT_COLS] != 0).any(axis=1) | (changes['status'] != 'changed')
+    return changes.loc[changed].reset_index()
+
+def geojson_features(gdf):
+    """
+    Serializes each row of a geopandas dataframe as a GeoJSON Feature with compact
+    separators.
+
+    Args:
+    gdf (geopandas dataframe): Geopandas dataframe to serialize.
+
+    Return:
+    features (generator): Strings of the features, one per row.
+    """
+    geometries = shapely.to_geojson(np.asarray(gdf.geometry.values))
+    props = gdf.drop(columns=gdf.geometry.name)
+    props = props.astype(object).where(props.notnull(), None)
+    columns = list(props.columns)
+    for values, geometry in zip(props.itertuples(index=False, name=None), geometries):
+        properties = json.dumps(dict(zip(columns, values)), ensure_ascii=False, separators=(',', ':'), default=str)
+        yield '{"type":"Feature","properties":' + properties + ',"geometry":' + (geometry or 'null') + '}'
+
+def geojson_chunks(gdf, var_name, features=None):
+    """
+    Serializes a geopandas dataframe as a GeoJSON FeatureCollection assigned to a 
+    javascript variable (e.g. "var la = {...}") so it can be loaded by the leaflet
+    map with a script tag. Features are serialized one at a time with 
+    geojson_features(), unless they have already been serialized.
+
+    Args:
+    gdf (geopandas dataframe): Geopandas dataframe to serialize.
+    var_name (str): Name of the javascript variable (e.g. "la").
+    features (iterable): Strings of the features of gdf if they have already been
+        serialized, e.g. by serialize_precinct_features() (default None).
+
+    Return:
+    chunks (generator): Strings that make up the file, one per feature.
+    """
+    yield 'var ' + var_name + ' = {"type":"FeatureCollection","features":[\n'
+    for i, feature in enumerate(geojson_features(gdf) if features is None else features):
+        yield (',\n' if i else '') + feature
+    yield '\n]}\n'
+
+def serialize_precinct_features(gdf, current, feature_cache=None):
+    """
+    Serializes each precinct as a GeoJSON Feature with geojson_features(), reusing
+    the features saved by a previous run for the precincts that diff_precincts()
+    finds unchanged since, so only new and changed precincts are serialized. The
+    saved features are keyed on the precinct geometry, so they are only reused
+    while the shapefile and its rounding stay the same.
+
+    Args:
+    gdf (geopandas dataframe): Precinct data to serialize with a 'precinct' column.
+    current (pandas dataframe): Precinct and county counts from this run with
+        'precinct' and COUNT_COLS columns.
+    feature_cache (str): File location for the features saved by a previous run
+        (default None, serialize every precinct).
+
+    Return:
+    features (pandas dataframe): 'precinct', COUNT_COLS and 'feature' by row of gdf,
+        to save for the next run once the output is written.
+    """
+    features = gdf[['precinct']].merge(current.drop_duplicates('precinct'), on='precinct', how='left')
+    features['feature'] = None
+    if feature_cache is not None and os.path.exists(feature_cache):
+        cached = pd.read_parquet(feature_cache)
+        # precincts without counts, such as those only in the shapefile, are unchanged
+        # as long as they still don't have any
+        changes = diff_precincts(cached.dropna(subset=COUNT_COLS), current)
+        reuse = (features['precinct'].isin(cached['precinct']) & ~features['precinct'].isin(changes['precinct'])).to_numpy()
+        features.loc[reuse, 'feature'] = features.loc[reuse, 'precinct'].map(cached.set_index('precinct')['feature'])
+    serialize = features['feature'].isnull().to_numpy()
+    print('Number of precinct features serialized:', serialize.sum(), 'of', len(features))
+    features.loc[serialize, 'feature'] = list(geojson_features(gdf.loc[serialize]))
+    return features
+
+def topojson_chunks(gdf, var_name, object_name, places=6):
+    """
+    Serializes a geopandas dataframe of polygons as a TopoJSON style topology 
+    assigned to a javascript variable (e.g. "var la_topo = {...}"), using 
+    topology.build_topology() to quantize coordinates and store shared boundaries
+    once. Properties are stored as a columnar attribute table, with one list of 
+    values per column in the same order as the geometries.
+
+    Args:
+    gdf (geopandas dataframe): Geopandas dataframe to serialize.
+    var_name (str): Name of the javascript variable (e.g. "la_topo").
+    object_name (str): Name of the geometry collection in the topology (e.g. "precincts").
+    places (int): Number of decimal places coordinates are quantized to (default 6).
+
+    Return:
+    chunks (generator): Strings that make up the file.
+    """
+    topo = build_topology(np.asarray(gdf.geometry.values), places=places)
+    props = gdf.drop(columns=gdf.geometry.name)
+    props = props.astype(object).where(props.notnull(), None)
+    dumps = lambda x: json.dumps(x, ensure_ascii=False, separators=(',', ':'), default=str)
+    yield 'var ' + var_name + ' = {"type":"Topology","transform":' + dumps(topo['transform'])
+    yield ',"arcs":[\n' + ',\n'.join(dumps(arc) for arc in topo['arcs']) + '\n]'
+    yield ',"objects":{' + dumps(object_name) + ':{"type":"GeometryCollection","geometries":' 
+    yield dumps(topo['geometries']) + '}}'
+    yield ',"attributes":' + dumps({col : props[col].tolist() for col in props.columns}) + '}\n'
+
+def write_js(chunks, output_file, archive_file):
+    """
+    Writes the strings making up an output file in a single pass to the dated 
+    archive file and to a temporary file that then atomically replaces the output 
+    file loaded by the map.
+
+    Args:
+    chunks (iterable): Strings to write, e.g. from geojson_chunks().
+    output_file (str): File location loaded by the map (e.g. "la_precincts.geojson").
+    archive_file (str): File location for the dated copy of the output.
+    """
+    tmp_file = output_file + '.tmp'
+    with open(tmp_file, 'w', encoding='utf-8') as output, open(archive_file, 'w', encoding='utf-8') as archive:
+        for chunk in chunks:
+            output.write(chunk)
+            archive.write(chunk)
+    os.replace(tmp_file, output_file)
+
+def write_geojs(gdf, var_name, output_file, archive_file):
+    """
+    Writes a geopandas dataframe as a GeoJSON FeatureCollection assigned to a 
+    javascript variable (e.g. "var la = {...}") with geojson_chunks() and write_js().
+
+    Args:
+    gdf (geopandas dataframe): Geopandas dataframe to write.
+    var_name (str): Name of the javascript variable (e.g. "la").
+    output_file (str): File location loaded by the map (e.g. "la_precincts.geojson").
+    archive_file (str): File location for the dated copy of the output.
+    """
+    write_js(geojson_chunks(gdf, var_name), output_file, archive_file)
+
+def write_tiles_js(gdf, var_name, output_file, archive_file, tile_root='tiles', minzoom=9, maxzoom=14):
+    """
+    Writes a geopandas dataframe as a pyramid of GeoJSON tiles with 
+    tiles.write_tile_pyramid() and writes a javascript file that tells the 
+    map where the tiles are (e.g. "var la_tiles = {...}"). Rows without geometry,
+    such as the county level data, are written to the javascript file instead
+    of the tiles. Each run writes to a new tile directory so cached tiles are 
+    never stale, and only the current and previous directories are kept.
+
+    Args:
+    gdf (geopandas dataframe): Geopandas dataframe to write.
+    var_name (str): Name of the javascript variable (e.g. "la_tiles").
+    output_file (str): File location loaded by the map (e.g. "la_precincts_tiles.js").
+    archive_file (str): File location for the dated copy of the javascript file.
+    tile_root (str): Directory location for tile directories (default "tiles").
+    minzoom (int): Lowest zoom level to cut tiles for (default 9).
+    maxzoom (int): Highest zoom level to cut tiles for (default 14).
+    """
+    name = os.path.splitext(os.path.basename(output_file))[0]
+    tile_dir = f'{tile_root}/{name}_{datetime.now().strftime("%Y%m%d%H%M%S")}'
+    count = write_tile_pyramid(gdf.loc[gdf.geometry.notnull()], tile_dir, minzoom=minzoom, maxzoom=maxzoom)
+    print('Number of tiles written to', tile_dir + ':', count)
+    props = gdf.loc[gdf.geometry.isnull()].drop(columns=gdf.geometry.name)
+    props = props.astype(object).where(props.notnull(), None)
+    meta = {
+        'url' : tile_dir + '/{z}/{x}/{y}.json',
+        'minzoom' : minzoom,
+        'maxzoom' : maxzoom,
+        'bounds' : gdf.total_bounds.tolist(),
+        'features' : props.to_dict('records'),
+    }
+    write_js(['var ' + var_name + ' = ' + json.dumps(meta, ensure_ascii=False, separators=(',', ':'), default=str) + '\n'], 
+        output_file, archive_file)
+    # remove tile directories older than the previous run
+    old_dirs = sorted(d for d in os.listdir(tile_root) if d.startswith(name + '_'))[:-2]
+    for d in old_dirs:
+        shutil.rmtree(f'{tile_root}/{d}')
+
+def write_shapes_js(gdf, var_name, output_file, archive_loc, geometry_key, places=6):
+    """
+    Writes the geometry of a geopandas dataframe, keyed by its remaining columns 
+    (e.g. precinct), as a topology with topojson_chunks(). The geometry only changes
+    when the shapefile does, so the file is versioned by the geometry cache key from
+    geometry_cache_key() and the ids, and the topology is only built when the archived
+    copy of that version is not already the file loaded by the map. The version lets
+    browsers cache the file indefinitely.
+
+    Args:
+    gdf (geopandas dataframe): Geopandas dataframe with geometry and id columns only.
+    var_name (str): Name of the javascript variable (e.g. "la_shapes").
+    output_file (str): File location loaded by the map (e.g. "la_precinct_shapes.js").
+    archive_loc (str): File location prefix for the archived copy, which is 
+        suffixed with the version.
+    geometry_key (str): Key of the cached geometry from geometry_cache_key().
+    places (int): Number of decimal places coordinates are quantized to (default 6).
+
+    Return:
+    script (str): File location with its version (e.g. "la_precinct_shapes.js?v=0123abcd").
+    """
+    ids = gdf.drop(columns=gdf.geometry.name)
+    version = hashlib.sha256(f'{geometry_key}:{var_name}:{places}:'.encode())
+    version.update(pd.util.hash_pandas_object(ids, index=False).to_numpy().tobytes())
+    version = version.hexdigest()[:12]
+    archive_file = f'{archive_loc}_{version}.js'
+    # an interrupted write leaves the archived copy different from the file loaded by the map
+    if not (os.path.exists(archive_file) and os.path.exists(output_file) 
+            and filecmp.cmp(archive_file, output_file, shallow=False)):
+        write_js(topojson_chunks(gdf, var_name, 'precincts', places=places), output_file, archive_file)
+    return f'{output_file}?v={version}'
+
+def compare_with_geojson(topojson, archive_dir):
+    """
+    Prints the size and parse time of a topology from topojson_chunks() next to
+    the size and parse time of the most recent GeoJSON archived in archive_dir,
+    rather than serializing the same data as GeoJSON. Parse time is measured with
+    python's json parser as a proxy for the browser.
+
+    Args:
+    topojson (str): Contents of the topology file.
+    archive_dir (str): Directory location of the archived GeoJSON outputs
+        (e.g. "data/final_geojsons/precincts").
+    """
+    archived = [f'{archive_dir}/{file}' for file in os.listdir(archive_dir)
+        if file.startswith('la_precincts_') and file.endswith('.geojson')]
+    if len(archived) == 0:
+        print('No archived GeoJSON in', archive_dir, 'to compare the topology with')
+        return
+    geojson_file = max(archived, key=os.path.getmtime)
+    with open(geojson_file, 'r', encoding='utf-8') as f:
+        geojson = f.read()
+    print('Precinct output compared with', geojson_file + ':')
+    base = None
+    for name, text in [('GeoJSON', geojson), ('TopoJSON', topojson)]:
+        start = time.perf_counter()
+        json.loads(text[text.index('=') + 1:])
+        parse = time.perf_counter() - start
+        size = len(text.encode('utf-8'))
+        base = base or size
+        print('  %-9s %.2f MB (%3.0f%%), parsed in %.3fs' % (name + ':', size/1e6, size/base*100, parse))
+
+def write_stats_js(df, county, extract, var_name, output_file, archive_file):
+    """
+    Writes the precinct and county counts as a compact columnar table assigned 
+    to a javascript variable (e.g. "var la_stats = {...}"), keyed by precinct and
+    versioned with the time of the data extract. The map joins the counts onto 
+    the precinct geometry and formats them for display.
+
+    Args:
+    df (pandas dataframe): Counts by precinct with 'precinct' and COUNT_COLS columns.
+    county (dict): County level totals of COUNT_COLS.
+    extract (str): Date and time of the data extract (e.g. "2020-12-08 08:45:23.963").
+    var_name (str): Name of the javascript variable (e.g. "la_stats").
+    output_file (str): File location loaded by the map (e.g. "la_precinct_stats.js").
+    archive_file (str): File location for the dated copy of the output.
+
+    Return:
+    script (str): File location with its version (e.g. "la_precinct_stats.js?v=20201208084523963").
+    """
+    stats = {
+        'extract' : extract,
+        'columns' : COUNT_COLS,
+        'precinct' : df['precinct'].tolist(),
+        'counts' : [df[col].astype('int64').tolist() for col in COUNT_COLS],
+        'county' : [int(county[col]) for col in COUNT_COLS],
+    }
+    write_js(['var ' + var_name + ' = ' + json.dumps(stats, ensure_ascii=False, separators=(',', ':')) + '\n'], 
+        output_file, archive_file)
+    return f'{output_file}?v=' + ''.join(c for c in str(extract) if c.isdigit())
 
-def process_precincts(precincts_shape, registered_voters, voters, output_loc, reduce_file=True, places=6):
+def record_history(registered_voters, voters, votecenter_gjson, votecenter_voters, extract, cache_dir='data/cache',
+    override_file='data/static/vc_name_overrides.csv', history_dir='data/history'):
+    """
+    Adds the precinct and vote center counts from an extract to the history store
+    without processing the map outputs, to backfill the store from archived extracts.
+    Counts that are already in the store are skipped.
+
+    Args:
+    registered_voters (str or file): File location or open file for registered voter data.
+    voters (str or file): File location or open file for votes cast data.
+    votecenter_gjson (str): File location for vote centers geojson.
+    votecenter_voters (str or file): File location or open file for vote centers voting data.
+    extract (str): Name of the extract zip file without its extension (e.g. "12082020_900am").
+    cache_dir (str): Directory location for cached parsed csvs (default "data/cache").
+    override_file (str): File location for manual matches of voting data vote center 
+        names to geojson names (default "data/static/vc_name_overrides.csv").
+    history_dir (str): Directory location for the history store (default "data/history").
+
+    Return:
+    added (list): Kinds of counts added to the store.
+    """
+    added = []
+    if not in_history('precincts', extract, history_dir):
+        reg = read_registered_voters(registered_voters, cache_file=extract_cache_file(cache_dir, extract, 'registered_voters'))
+        vote = read_votes(voters, cache_file=extract_cache_file(cache_dir, extract, 'votes'))
+        join, county = aggregate_votes(vote)
+        counts = pd.concat([
+            merge_precinct_counts(reg, join)[['precinct'] + COUNT_COLS],
+            county_counts(county, reg['# of Active Voters'].sum())
+        ], ignore_index=True)
+        if append_history(counts.astype({col : 'int64' for col in COUNT_COLS}), 'precincts', extract, vote.loc[0, 'Date/Time Extract Run'], history_dir):
+            added.append('precincts')
+    if not in_history('vote_centers', extract, history_dir):
+        vc = read_vote_center_votes(votecenter_voters, cache_file=extract_cache_file(cache_dir, extract, 'vote_center_votes'))
+        date_time = vc['Date/Time Extract Run'].iloc[0] if len(vc) > 0 else None
+        vc, matches = sum_vote_centers(vc, gpd.read_file(votecenter_gjson, driver='GeoJSON'), overrides=read_overrides(override_file))
+        if append_history(vc, 'vote_centers', extract, date_time, history_dir):
+            added.append('vote_centers')
+    return added
+
+def process_precincts(precincts_shape, registered_voters, voters, output_loc, reduce_file=True, places=6,
+    snapshot='data/precinct_snapshot.parquet', changes_loc='data/precinct_changes.csv',
+    cache_dir='data/cache', output_format='split', extract=None, history_dir='data/history', 
+    summary_file='data/county_level_summary.csv', incremental=True):
     """
     Process precinct level voting data for LA county and output geojson to be 
-    used in leaflet map.
+    used in leaflet map. The time, memory and rows of each stage are recorded 
+    with instrumentation.stage().
 
     Args:
     precincts_shape (str): File location for precincts shapefile
         (filename: "registrar_precincts_4326.shp").
-    registered_voters (str): File location for registered voter data 
+    registered_voters (str or file): File location or open file for registered voter data 
         (filename: "1- Count of registered voters by precinct.csv")
-    voters (str): File location for registered voter data 
+    voters (str or file): File location or open file for votes cast data 
         (filename: "2- Count of votes cast (broken out by VBM and in-person ballots) by precinct.csv")
     output_loc (str): Directory location for output geojson file.
     round_coords (bool): True or False for whether to round precinct polygon 
         coordinates to reduce file size (default True).
     places (int): Number of decimal places to round precinct polygon coordinates to, 
         as an integer (default 6 at .01m accuracy).
+    snapshot (str): File location for the precinct counts saved between runs 
+        (default "data/precinct_snapshot.parquet").
+    changes_loc (str): File location for the csv of precincts that changed since 
+        the previous run (default "data/precinct_changes.csv").
+    cache_dir (str): Directory location for cached precinct geometry and parsed csvs
+        (default "data/cache").
+    output_format (str): 'split' to write the precinct geometry, which only changes 
+        with the shapefile, to "la_precinct_shapes.js" and the counts, which change 
+        every run, to "la_precinct_stats.js", 'geojson' to write "la_precincts.geojson", 
+        'topojson' to write a quantized topology with shared boundaries to 
+        "la_precincts.topojson", or 'tiles' to write
+        a pyramid of tiles to "tiles/" described by "la_precincts_tiles.js" (default 'split').
+    extract (str): Name of the extract zip file without its extension (e.g. "12082020_900am"),
+        used to cache the parsed csvs so later runs on the same extract skip parsing 
+        them, and to add the counts to the history store (default None, no caching or history).
+    history_dir (str): Directory location for the history store (default "data/history").
+    summary_file (str): File location for the county level summary each extract is appended to
+        once, after the output is written (default "data/county_level_summary.csv").
+    incremental (bool): True to only serialize the precincts whose counts changed since 
+        the previous geojson run with the same precinct geometry, reusing the features 
+        saved in cache_dir for the rest (default True). The split output only rebuilds 
+        the shapes when the geometry changes, and the topojson and tiles outputs are 
+        always rebuilt in full.
+
+    Return:
+    scripts (list): File locations of the precinct files for index.html to load.
     """
-    # read in voting data
-    prec = gpd.read_file(precincts_shape)
-    reg = pd.read_csv(registered_voters)
-    vote = pd.read_csv(voters)
+    # read in precinct geometry, simplified and rounded if reducing file size, and voting data
+    with stage('read geometry') as record:
+        if reduce_file == True:
+            geometry_key = geometry_cache_key(precincts_shape, places=places)
+            prec = load_precinct_geometry(precincts_shape, places=places, cache_dir=cache_dir, key=geometry_key)
+        else:
+            geometry_key = geometry_cache_key(precincts_shape, places=0, tolerance=0)
+            prec = load_precinct_geometry(precincts_shape, places=0, tolerance=0, cache_dir=cache_dir, key=geometry_key)
+        record['rows'] = len(prec)
+    with stage('read csvs') as record:
+        reg = read_registered_voters(registered_voters, cache_file=extract_cache_file(cache_dir, extract, 'registered_voters'))
+        vote = read_votes(voters, cache_file=extract_cache_file(cache_dir, extract, 'votes'))
+        record['rows'] = len(reg) + len(vote)
     # save time of update
     date_time = vote.loc[0, 'Date/Time Extract Run']
-    # break out VBM data by mail, drop box, and vote center drop box
-    mail = vote.loc[vote['VBM Return Method Code'] == 'Mail']
-    mail = mail.groupby(['VPH HomePrecinct Number']).sum().reset_index()
-    mail['VBM Return Method Code'] = 'Mail'
-    db = vote.loc[vote['VBM Return Method Code'] == 'Drop Box']
-    db = db.groupby(['VPH HomePrecinct Number']).sum().reset_index()
-    db['VBM Return Method Code'] = 'Drop Box'
-    do = vote.loc[vote['VBM Return Method Code'] == 'Vote Center Drop Off']
-    do = do.groupby(['VPH HomePrecinct Number']).sum().reset_index()
-    do['VBM Return Method Code'] = 'Vote Center Drop Off'
-    # reshapeVBM data
-    all_mail = mail.merge(db, on='VPH HomePrecinct Number', how='outer', suffixes=(None, '_db'), validate='1:1').merge(do, on='VPH HomePrecinct Number', how='outer', suffixes=(None, '_do'), validate='1:1')
-    all_mail.loc[all_mail['VBM Return Method Code_db'].notnull(), 'VBM Return Method Code'] = all_mail['VBM Return Method Code_db']
-    all_mail.loc[all_mail['VBM Return Method Code_do'].notnull(), 'VBM Return Method Code'] = all_mail['VBM Return Method Code_do']
-    all_mail = all_mail[['# of Votes accepted', 'VPH HomePrecinct Number', '# of Votes accepted_db', '# of Votes accepted_do']]
-    all_mail.rename(columns = {
-        '# of Votes accepted' : 'Mail',
-        '# of Votes accepted_db' : 'Drop Box',
-        '# of Votes accepted_do' : 'Vote Center Drop Off',
-    }, inplace=True)
-    # reshape in-person polls data
-    polls = vote.loc[vote['Voting Type'] == 'In Person Live Ballot']
-    polls = polls.groupby(['VPH HomePrecinct Number']).sum().reset_index()
-    polls['Voting Type'] = 'In Person Live Ballot'
-    # reshape total votes cast and cvr data
-    total = vote.groupby('VPH HomePrecinct Number').sum().reset_index()
-    cvr = vote.loc[vote['Voting Type'] == 'CVR']
-    cvr = cvr.groupby(['VPH HomePrecinct Number']).sum().reset_index()
-    cvr['Voting Type'] = 'CVR'
-    # join total votes, CVR, in-person, and VBM data
-    join = all_mail.merge(polls, on='VPH HomePrecinct Number', how='outer', validate='1:1').merge(cvr, on='VPH HomePrecinct Number', how='outer', suffixes=(None, '_cvr'), validate='1:1').merge(total, on='VPH HomePrecinct Number', how='outer', suffixes=(None, '_total'), validate='1:1')
-    join = join[['Mail', 'VPH HomePrecinct Number', 'Drop Box', 'Vote Center Drop Off', '# of Votes accepted',
-            '# of Votes accepted_cvr', '# of Votes accepted_total']]
-    join.rename(columns = {
-        '# of Votes accepted' : 'In Person Live Ballot',
-        '# of Votes accepted_cvr' : 'Conditional Voter Registration',
-        '# of Votes accepted_total' : 'Total Votes',
-        'VPH HomePrecinct Number' : 'PrecinctNumber'
-    }, inplace=True)
-    # change nas to 0s
-    join[['Mail', 'In Person Live Ballot', 'Drop Box', 'Vote Center Drop Off', 
-      'Conditional Voter Registration', 'Total Votes']] = join[[
-          'Mail', 'In Person Live Ballot', 'Drop Box', 'Vote Center Drop Off', 
-          'Conditional Voter Registration', 'Total Votes']].fillna(value=0)
-
-    # merge voting data and registered voter data after first formatting 
-    # precinct number
-    reg['Voter Precinct Number'] = reg['Voter Precinct Number'].astype(str).apply(lambda x: x.replace(".", "").replace("-", ""))
-    join['PrecinctNumber'] = join['PrecinctNumber'].astype(str).apply(lambda x: x.replace(".", "").replace("-", ""))
-    df = reg.merge(join, left_on='Voter Precinct Number', right_on='PrecinctNumber', how='outer', suffixes=(None, '_voter'), validate='1:1')
-    # clean up data
-    df.rename(columns = {'# of Active Voters' : 'Number of Active Voters'},inplace=True)
-    print('Number of precincts with voting data without registered voter data:', len(df.loc[df['Voter Precinct Number'].isna()]))
-    # fill registered voter precinct number with voting data precinct number 
-    df['precinct'] = np.where(df['PrecinctNumber'].notnull(), df['PrecinctNumber'], df['Voter Precinct Number'])
-    df.drop(columns=['PrecinctNumber', 'Voter Precinct Number', 'Voter County', 'Voter Precinct Name'], inplace=True)
-    # add percent votes variable, first filling nas with 0s in registered voter and voter cols
-    cols = ['Total Votes', 'Mail', 'In Person Live Ballot', 'Drop Box', 'Vote Center Drop Off', 
-        'Conditional Voter Registration', 'Number of Active Voters']
-    for col in cols:
-        df[col] = df[col].fillna(0)
+    # aggregate votes cast by precinct and vote type in a single pass
+    with stage('aggregate') as record:
+        join, county = aggregate_votes(vote)
+
+        # merge voting data and registered voter data, precinct numbers are formatted 
+        # when the csvs are read
+        df = merge_precinct_counts(reg, join)
+        record['rows'] = len(df)
+    print('Number of precincts with voting data without registered voter data:', 
+        (~df['precinct'].isin(reg['Voter Precinct Number'])).sum())
+    counts = df[['precinct'] + COUNT_COLS]
+    # add percent votes variable
     df['pctvote'] = round((df['Total Votes']/df['Number of Active Voters'])*100, 1)
     print('Number of precincts dropped with more voters than registered voters:',
         str(len(df.loc[(df['Number of Active Voters'] > 0) & (df['pctvote'] > 100)])))
@@ -141,51 +683,46 @@ def process_precincts(precincts_shape, registered_voters, voters, output_loc, re
     df = df.loc[df['pctvote'] <= 100]
     # hardcode tooltip columns to read as strings with percent rounded to one decimal
     # and total (e.g. "33.1% (4)""). In the future, take this out and style in js code
-    cols = ['Total Votes', 'Mail', 'In Person Live Ballot', 'Drop Box', 'Vote Center Drop Off']
-    new_cols = ['Percent Votes Cast', 'Percent Mail', 'Percent Poll', 'Percent Drop Box', 
-                'Percent Vote Center Drop Off']
-    for idx, row in df.iterrows():
-        for i, col in enumerate(cols):
-            if (col == 'Total Votes') & (row['Number of Active Voters'] > 0):
-                pct = round((row[col]/row['Number of Active Voters'])*100, 1)
-            elif row['Total Votes'] > 0:
-                pct = round((row[col]/row['Total Votes'])*100, 1)
-            else:
-                pct = np.nan
-            if math.isnan(pct):
-                df.at[idx, new_cols[i]] = 'n/a' 
-            elif col == 'Total Votes':
-                df.at[idx, new_cols[i]] = str(pct) + '%'
-            else:
-                df.at[idx, new_cols[i]] = str(pct) + '% (' + str(int(row[col])) + ')'
+    with stage('format', rows=len(df)):
+        df = format_tooltips(df)
                 
     # setup spatial data
     # join processed precinct data with precinct shapefile
-    prec['PRECINCT'] = prec['PRECINCT'].astype(str)
-    gdf = gpd.GeoDataFrame(prec.merge(df, left_on='PRECINCT', right_on='precinct', how='outer', validate='1:1'), geometry='geometry')
-    # drop precincts without a valid precinct number 
-    print('Number of precincts dropped without a valid precinct number:', len(gdf[gdf['PRECINCT'].isna()]))
-    gdf = gdf[~gdf['PRECINCT'].isna()]
+    with stage('spatial join') as record:
+        gdf = gpd.GeoDataFrame(prec.merge(df, left_on='PRECINCT', right_on='precinct', how='outer', validate='1:1'), geometry='geometry')
+        # drop precincts without a valid precinct number 
+        print('Number of precincts dropped without a valid precinct number:', len(gdf[gdf['PRECINCT'].isna()]))
+        gdf = gdf[~gdf['PRECINCT'].isna()]
+        record['rows'] = len(gdf)
     # create county level summary variables
     # hardcode in styling - in the future take this out and style in js
-    total_votes = vote['# of Votes accepted'].sum()
+    total_votes = county['Total Votes']
     total_reg = reg['# of Active Voters'].sum()
     pct = str(round((total_votes/total_reg)*100, 1)) + '%'
     reg_voters = str("{:,}".format(total_reg)).split('.')[0]
     voters = str("{:,}".format(total_votes)).split('.')[0]
-    cvr = str("{:,}".format(vote.loc[vote['Voting Type'] == 'CVR', '# of Votes accepted'].sum())).split('.')[0]
-    total_mail = vote.loc[vote['VBM Return Method Code'] == 'Mail', '# of Votes accepted'].sum()
+    cvr = str("{:,}".format(county['Conditional Voter Registration'])).split('.')[0]
+    total_mail = county['Mail']
     mail = str("{:,}".format(total_mail)).split('.')[0]
     pct_mail = str(round((total_mail/total_votes)*100, 1)) + '% (' + mail + ')'
-    total_db = vote.loc[vote['VBM Return Method Code'] == 'Drop Box', '# of Votes accepted'].sum()
+    total_db = county['Drop Box']
     db = str("{:,}".format(total_db)).split('.')[0]
     pct_db = str(round((total_db/total_votes)*100, 1)) + '% (' + db + ')'
-    total_poll = vote.loc[vote['Voting Type'] == 'In Person Live Ballot', '# of Votes accepted'].sum()
+    total_poll = county['In Person Live Ballot']
     poll = str("{:,}".format(total_poll)).split('.')[0]
     pct_poll = str(round((total_poll/total_votes)*100, 1)) + '% (' + poll + ')'
-    total_do = vote.loc[vote['VBM Return Method Code'] == 'Vote Center Drop Off', '# of Votes accepted'].sum()
+    total_do = county['Vote Center Drop Off']
     do = str("{:,}".format(total_do)).split('.')[0]
     pct_do = str(round((total_do/total_votes)*100, 1)) + '% (' + do + ')'
+    # report the precincts that changed since the counts saved by the previous run
+    current = pd.concat([counts, county_counts(county, total_reg)], ignore_index=True)
+    previous = pd.read_parquet(snapshot) if os.path.exists(snapshot) else None
+    # a rerun of an extract that is already in the history store is already in the county summary
+    rerun = extract is not None and in_history('precincts', extract, history_dir)
+    with stage('diff', rows=len(current)):
+        changes = diff_precincts(previous, current) if previous is not None else None
+        if changes is not None:
+            changes.to_csv(changes_loc, index=False)
     # reduce the number of columns in gdf to minimize output file size
     gdf = gdf[['PRECINCT', 'geometry', 'Number of Active Voters', 'Total Votes',
         'pctvote', 'Percent Votes Cast', 'Percent Mail', 'Percent Drop Box', 
@@ -198,9 +735,6 @@ def process_precincts(precincts_shape, registered_voters, voters, output_loc, re
     cols = ['Percent Votes Cast', 'Percent Mail', 'Percent Drop Box', 'Percent Poll', 'Percent Vote Center Drop Off']
     for col in cols:
         gdf[col] = gdf[col].fillna('n/a')
-    # round coordinate decimals and simplify geometry if reducing file size
-    if reduce_file == True:
-        gdf = round_gdf(gdf)
     # append county level data
     gdf = gdf.append({
         'precinct' : 'Los Angeles',
@@ -218,13 +752,21 @@ def process_precincts(precincts_shape, registered_voters, voters, output_loc, re
     for col in cols:
         data[col] = data[col].str.replace(',', '').astype('int64')
     data['Date/Time'] = date_time
-    county_sum = pd.read_csv('data/county_level_summary.csv')
-    county_sum = county_sum.append(data)
-    county_sum.to_csv('data/county_level_summary.csv', index=False)
-    # print county summary stats
-    new_reg_voters = county_sum.iloc[-1]['Number of Active Voters'] - county_sum.iloc[-2]['Number of Active Voters']
-    new_votes = county_sum.iloc[-1]['Total Votes'] - county_sum.iloc[-2]['Total Votes']
-    new_cvr = county_sum.iloc[-1]['Conditional Voter Registration'] - county_sum.iloc[-2]['Conditional Voter Registration']
+    previous_county = read_county_summary(summary_file).iloc[-1] if os.path.exists(summary_file) else None
+    # print county summary stats, using the change report if there is a previous run
+    if changes is not None:
+        county_changes = changes.set_index('precinct').reindex(['Los Angeles'])[COUNT_COLS].fillna(0).astype('int64').iloc[0]
+        new_reg_voters = county_changes['Number of Active Voters']
+        new_votes = county_changes['Total Votes']
+        new_cvr = county_changes['Conditional Voter Registration']
+    elif previous_county is not None:
+        new_reg_voters = data.iloc[0]['Number of Active Voters'] - previous_county['Number of Active Voters']
+        new_votes = data.iloc[0]['Total Votes'] - previous_county['Total Votes']
+        new_cvr = data.iloc[0]['Conditional Voter Registration'] - previous_county['Conditional Voter Registration']
+    else:
+        new_reg_voters = data.iloc[0]['Number of Active Voters']
+        new_votes = data.iloc[0]['Total Votes']
+        new_cvr = data.iloc[0]['Conditional Voter Registration']
     print()
     print('The number of registered voters changed by:', new_reg_voters)
     print('The number of total votes changed by:', new_votes)
@@ -237,90 +779,164 @@ def process_precincts(precincts_shape, registered_voters, voters, output_loc, re
         print('WARNING: The total number of votes decreased.')
     if new_cvr < 0:
         print('WARNING: The total number of CVRs decreased.')
+    # run the same checks precinct by precinct
+    if changes is not None:
+        prec_changes = changes.loc[changes['precinct'] != 'Los Angeles']
+        print('Number of precincts with changed counts:', len(prec_changes), '(see '+changes_loc+')')
+        checks = [
+            (prec_changes['Conditional Voter Registration'] > prec_changes['Total Votes'], 
+                'the increase in CVRs is greater than the increase in total votes'),
+            (prec_changes['Number of Active Voters'] < 0, 'the number of registered voters decreased'),
+            (prec_changes['Total Votes'] < 0, 'the number of votes decreased'),
+            (prec_changes['Conditional Voter Registration'] < 0, 'the number of CVRs decreased'),
+        ]
+        for check, message in checks:
+            if check.any():
+                print('WARNING: In', check.sum(), 'precincts', message + ':', 
+                    ', '.join(prec_changes.loc[check, 'precinct'].head(10)) + (', ...' if check.sum() > 10 else ''))
     # write to geojson with date and time in filename
-    today = date.today()
-    time = datetime.now().strftime('%I%p')
-    gdf.to_file(f'{output_loc}/precincts/la_precincts_{today}_{time}.geojson', driver='GeoJSON')
-    with open(f'{output_loc}/precincts/la_precincts_{today}_{time}.geojson','r') as f:
-        d = f.read()
-    with open(f'{output_loc}/precincts/la_precincts_{today}_{time}.geojson','w') as f:
-        f.write('var la = '+d)
-    os.replace(f'{output_loc}/precincts/la_precincts_{today}_{time}.geojson', 'la_precincts.geojson')
+    features = None
+    with stage('serialize', rows=len(gdf)):
+        today = date.today()
+        time = datetime.now().strftime('%I%p')
+        if output_format == 'split':
+            shapes = write_shapes_js(gdf.loc[gdf.geometry.notnull(), ['precinct', 'geometry']], 'la_shapes', 
+                'la_precinct_shapes.js', f'{output_loc}/precincts/la_precinct_shapes', geometry_key, places=places)
+            stats = write_stats_js(df.loc[df['precinct'].isin(gdf['precinct'])], {**county, 'Number of Active Voters' : total_reg}, 
+                date_time, 'la_stats', 'la_precinct_stats.js', f'{output_loc}/precincts/la_precinct_stats_{today}_{time}.js')
+            scripts = [shapes, stats]
+        elif output_format == 'topojson':
+            topojson = ''.join(topojson_chunks(gdf, 'la_topo', 'precincts', places=places))
+            write_js([topojson], 'la_precincts.topojson', f'{output_loc}/precincts/la_precincts_{today}_{time}.topojson')
+            scripts = ['la_precincts.topojson']
+            with stage('compare'):
+                compare_with_geojson(topojson, f'{output_loc}/precincts')
+        elif output_format == 'tiles':
+            write_tiles_js(gdf, 'la_tiles', 'la_precincts_tiles.js', f'{output_loc}/precincts/la_precincts_tiles_{today}_{time}.js')
+            scripts = ['la_precincts_tiles.js']
+        else:
+            feature_cache = f'{cache_dir}/precinct_features_{geometry_key}.parquet'
+            features = serialize_precinct_features(gdf, current, feature_cache if incremental else None)
+            write_js(geojson_chunks(gdf, 'la', features=features['feature']), 'la_precincts.geojson', 
+                f'{output_loc}/precincts/la_precincts_{today}_{time}.geojson')
+            scripts = ['la_precincts.geojson']
+    # save the precinct and county counts, and the serialized features, for the next run 
+    # only once the output is written, so a failed run isn't compared against as if it had shipped
+    current.to_parquet(snapshot, index=False)
+    # add the precinct and county counts to the history store and the county summary
+    if extract is not None:
+        with stage('history', rows=len(current)):
+            append_history(current[['precinct'] + COUNT_COLS].astype({col : 'int64' for col in COUNT_COLS}), 
+                'precincts', extract, date_time, history_dir)
+    if not rerun:
+        with stage('county summary'):
+            data.to_csv(summary_file, mode='a', header=previous_county is None, index=False)
+    if features is not None and incremental:
+        os.makedirs(cache_dir, exist_ok=True)
+        features.to_parquet(feature_cache + '.tmp', index=False)
+        os.replace(feature_cache + '.tmp', feature_cache)
+    return scripts
 
 
-def process_votecenters(votecenter_gjson, votecenter_voters, votecenter_alloc, output_loc):
+def consolidate_vote_centers(vc_final, sum_cols=VC_SUM_COLS):
+    """
+    Combines vote centers that share an address into the first vote center at 
+    the address, summing their votes and allocations. Vote centers without an 
+    address are dropped. Keeps the first row of each address with drop_duplicates()
+    and sums with a built-in groupby reduction, rather than calling a python 
+    function per address and column.
+
+    Args:
+    vc_final (pandas dataframe): Vote center data with an 'Address' column.
+    sum_cols (list): Columns to sum across vote centers at the same address 
+        (default VC_SUM_COLS, votes accepted and bmd and epoll book allocations).
+
+    Return:
+    vc_final (pandas dataframe): Vote center data with one row per address, sorted by address.
+    """
+    # keep track of total number of votes accepted and length of dataset to test after grouping by address
+    total_votes = vc_final.loc[vc_final['Address'].notnull(), '# of Votes accepted'].sum()
+    start_len = len(vc_final) 
+    num_dupes = len(vc_final) - (len(vc_final['Address'].unique())-1)
+    sums = vc_final.groupby('Address')[sum_cols].sum()
+    # the first row of each address, including its nas, like taking the first row of each group
+    vc_final = vc_final.loc[vc_final['Address'].notnull()].drop_duplicates('Address').sort_values('Address', ignore_index=True)
+    vc_final[sum_cols] = sums.loc[vc_final['Address']].to_numpy()
+    new_total_votes = vc_final['# of Votes accepted'].sum()
+    end_len = len(vc_final)
+    assert total_votes == new_total_votes, "Total number of votes accepted differ after dropping duplicates"
+    assert start_len - end_len == num_dupes, "Wrong number of duplicates deleted"
+    return vc_final
+
+def process_votecenters(votecenter_gjson, votecenter_voters, votecenter_alloc, output_loc, cache_dir='data/cache', 
+    extract=None, override_file='data/static/vc_name_overrides.csv', history_dir='data/history'):
     """
     Process vote center data for LA county and output geojson to be used in 
-    leaflet map.
+    leaflet map. The time, memory and rows of each stage are recorded with 
+    instrumentation.stage().
 
     Args:
     votecenter_gjson (str): File location for vote centers geojson 
         (filename: "vote_centers_locs.geojson")
-    votecenter_voters (str): File location for vote centers voting data 
+    votecenter_voters (str or file): File location or open file for vote centers voting data 
         (filename: "3- Count of in-person ballots cast for each vote center 
         with VBM return method_LA.csv")
     votecenter_alloc (str): File location for vote centers allocation data
         (filename: "LA Vote Center_allocations_20201027.xlsx")
     output_loc (str): Directory location for output geojson file.
+    cache_dir (str): Directory location for cached parsed csvs (default "data/cache").
+    extract (str): Name of the extract zip file without its extension (e.g. "12082020_900am"),
+        used to cache the parsed csv so later runs on the same extract skip parsing 
+        it, and to add the counts to the history store (default None, no caching or history).
+    override_file (str): File location for manual matches of voting data vote center 
+        names to geojson names (default "data/static/vc_name_overrides.csv").
+    history_dir (str): Directory location for the history store (default "data/history").
     """
     # read in vote center shapefile and voter data
-    vc_gdf = gpd.read_file(votecenter_gjson, driver='GeoJSON')
-    vc = pd.read_csv(votecenter_voters)
-    vc_alloc = pd.read_excel(votecenter_alloc)
-    # sum vote totals by vote center across all days
-    vc = vc.groupby(['Vote Location Name', 'Vote Location Address'], as_index=False).sum()
-    # clean up voting data vote center names with typos to be able to join data on geojson
-    vc.loc[vc['Vote Location Name'].str.contains('DOCKWEILER'), 'Vote Location Name'] = 'DOCKWEILER YOUTH CENTER - COMMUNITY ROOMS A, B AND C'
-    vc.loc[vc['Vote Location Name'].str.contains('FLEX VOTE'), 'Vote Location Name'] = vc['Vote Location Name'].str.replace(' - RR/CC', '')
-    vc.loc[vc['Vote Location Name'].str.contains('FOUR POINTS BY SHERATON LA WESTSIDE'), 'Vote Location Name'] = vc['Vote Location Name'].str.replace(' AND ', '/' )
-    vc.loc[vc['Vote Location Name'].str.contains('LENNOX PARK - COMMUNITY ROOM'), 'Vote Location Name'] = vc['Vote Location Name'].str.replace(' AND ', '&' )
-    vc.loc[vc['Vote Location Name'].str.contains('LOS ANGELES MISSION COLLEGE'), 'Vote Location Name'] = vc['Vote Location Name'].str.replace(' 1', '' )
-    vc.loc[vc['Vote Location Name'].str.contains('MOBILE VOTE CENTER'), 'Vote Location Name'] = vc['Vote Location Name'].str.replace(' - RR/CC', '')
-    vc.loc[vc['Vote Location Name'].str.contains('POP UP'), 'Vote Location Name'] = vc['Vote Location Name'].str.replace(' - RR/CC', '')
-    vc.loc[vc['Vote Location Name'].str.contains('SKIRBALL'), 'Vote Location Name'] = vc['Vote Location Name'].str.replace(' 1', '' )
-    vc.loc[vc['Vote Location Name'].str.contains('DOROTHY CHANDLER'), 'Vote Location Name'] = vc['Vote Location Name'].str.replace('CHANDLER', 'CHANDLER,' )
+    with stage('read') as record:
+        vc_gdf = gpd.read_file(votecenter_gjson, driver='GeoJSON')
+        vc = read_vote_center_votes(votecenter_voters, cache_file=extract_cache_file(cache_dir, extract, 'vote_center_votes'))
+        vc_alloc = pd.read_excel(votecenter_alloc)
+        record['rows'] = len(vc)
+    date_time = vc['Date/Time Extract Run'].iloc[0] if len(vc) > 0 else None
+    # sum vote totals by vote center across all days and match voting data vote center 
+    # names to the geojson names, allowing for typos and differences in formatting, 
+    # to be able to join data on geojson
+    with stage('aggregate', rows=len(vc)):
+        vc, matches = sum_vote_centers(vc, vc_gdf, overrides=read_overrides(override_file))
+        report_matches(matches, vc_gdf)
+    # add the vote center counts to the history store
+    if extract is not None:
+        with stage('history'):
+            append_history(vc, 'vote_centers', extract, date_time, history_dir)
     # join geojson and voter data
-    merged = vc_gdf.merge(vc, left_on='Name', right_on='Vote Location Name', how='outer')
-    print()
-    print("Number of Vote Centers with voting data without a match:", len(merged[merged['Address'].isna()]))
-    # code to output mismatches to csv if vote center names need to be cleaned
-    ## vc_mismatches = merged.loc[merged['Address'].isna()].to_csv('data/testing/vc_mismatches.csv')
-    # join vote center allocation data with vote center shapes and vote data
-    vc_final = merged.merge(vc_alloc, left_on='Vote Location Id', right_on='vote_center_sos_id', how='outer')
-    print('Number of Vote Centers with allocation data without a match:', 
-        len(vc_final[vc_final['County Id'].isna() & vc_final['Vote Location Name'].isna()]))
-    # combine votes and allocation data for vote centers that share a location and remove all but the first vote center 
-    # to do : fix names when vote center that summed votes are assigned to needs to be made more general
-    # keep track of total number of votes accepted and length of dataset to test after grouping by address
-    total_votes = vc_final.loc[vc_final['Address'].notnull(), '# of Votes accepted'].sum()
-    start_len = len(vc_final) 
-    num_dupes = len(vc_final) - (len(vc_final['Address'].unique())-1)
-    first = lambda x: x.iloc[0]
-    sum_cols = ['# of Votes accepted', 'bmd_allocated', 'ePollBook_Allocated']
-    vc_final = vc_final.groupby('Address', as_index=False).agg({**{col: np.sum for col in sum_cols}, **{col: first for col in vc_final.columns if col not in sum_cols + ["Address"]}})
-    new_total_votes = vc_final['# of Votes accepted'].sum()
-    end_len = len(vc_final)
-    assert total_votes == new_total_votes, "Total number of votes accepted differ after dropping duplicates"
-    assert start_len - end_len == num_dupes, "Wrong number of duplicates deleted"
+    with stage('spatial join') as record:
+        merged = vc_gdf.merge(vc, left_on='Name', right_on='Vote Location Name', how='outer')
+        # code to output mismatches to csv if vote center names need to be cleaned
+        ## matches.loc[matches['Name'].isna()].to_csv('data/testing/vc_mismatches.csv')
+        # join vote center allocation data with vote center shapes and vote data
+        vc_final = merged.merge(vc_alloc, left_on='Vote Location Id', right_on='vote_center_sos_id', how='outer')
+        print('Number of Vote Centers with allocation data without a match:', 
+            len(vc_final[vc_final['County Id'].isna() & vc_final['Vote Location Name'].isna()]))
+        # combine votes and allocation data for vote centers that share a location and remove all but the first vote center 
+        # to do : fix names when vote center that summed votes are assigned to needs to be made more general
+        vc_final = consolidate_vote_centers(vc_final)
+        record['rows'] = len(vc_final)
     # clean up data
-    vc_final['Vote Center Type'] = np.where(vc_final['Hours Of Operation'].str.contains('OCTOBER 24'), 'Eleven-Day', 'Five-Day')
-    vc_final = vc_final[['Name', 'Address', '# of Votes accepted', 'Vote Center Type', 
-                        'geometry', 'size', 'bmd_allocated', 'ePollBook_Allocated']]
-    vc_final.rename(columns={
-        '# of Votes accepted' : 'Number of Votes Accepted',
-        'ePollBook_Allocated' : 'epoll_allocated'
-    }, inplace=True)
-    vc_final[['Number of Votes Accepted', 'epoll_allocated', 'bmd_allocated']] = vc_final[['Number of Votes Accepted', 'epoll_allocated', 'bmd_allocated']].fillna('n/a')
-    vc_final['Name'] = vc_final['Name'].str.title()
-    vc_final['size'] = vc_final['size'].str.title()
-    vc_final = gpd.GeoDataFrame(vc_final, geometry='geometry')
+    with stage('format', rows=len(vc_final)):
+        vc_final['Vote Center Type'] = np.where(vc_final['Hours Of Operation'].str.contains('OCTOBER 24'), 'Eleven-Day', 'Five-Day')
+        vc_final = vc_final[['Name', 'Address', '# of Votes accepted', 'Vote Center Type', 
+                            'geometry', 'size', 'bmd_allocated', 'ePollBook_Allocated']]
+        vc_final.rename(columns={
+            '# of Votes accepted' : 'Number of Votes Accepted',
+            'ePollBook_Allocated' : 'epoll_allocated'
+        }, inplace=True)
+        vc_final[['Number of Votes Accepted', 'epoll_allocated', 'bmd_allocated']] = vc_final[['Number of Votes Accepted', 'epoll_allocated', 'bmd_allocated']].fillna('n/a')
+        vc_final['Name'] = vc_final['Name'].str.title()
+        vc_final['size'] = vc_final['size'].str.title()
+        vc_final = gpd.GeoDataFrame(vc_final, geometry='geometry')
     # write to geojson
-    today = date.today()
-    time = datetime.now().strftime('%I%p')
-    vc_final.to_file(f'{output_loc}/vote_centers/vote_centers_{today}_{time}.geojson', 
-    driver='GeoJSON')
-    with open(f'{output_loc}/vote_centers/vote_centers_{today}_{time}.geojson','r') as f:
-        d = f.read()
-    with open(f'{output_loc}/vote_centers/vote_centers_{today}_{time}.geojson','w') as f:
-        f.write('var vc = '+d)
-    os.replace(f'{output_loc}/vote_centers/vote_centers_{today}_{time}.geojson', 'vote_centers.geojson')
\ No newline at end of file
+    with stage('serialize', rows=len(vc_final)):
+        today = date.today()
+        time = datetime.now().strftime('%I%p')
+        write_geojs(vc_final, 'vc', 'vote_centers.geojson', f'{output_loc}/vote_centers/vote_centers_{today}_{time}.geojson')
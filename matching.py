@@ -0,0 +1,141 @@
+import os
+import difflib
+import pandas as pd
+
+def normalize_names(names):
+    """
+    Normalizes vote center names so small differences in how the registrar writes
+    them don't prevent a match: case folds, drops the " - RR/CC" suffix, writes
+    "&" and "/" as "AND", and removes punctuation and repeated spaces
+    (e.g. "LENNOX PARK - COMMUNITY ROOM A&B" to "LENNOX PARK COMMUNITY ROOM A AND B").
+
+    Args:
+    names (pandas series): Vote center names.
+
+    Return:
+    names (pandas series): Normalized vote center names.
+    """
+    names = names.str.upper().str.replace(r'\s*-\s*RR/CC$', '', regex=True)
+    names = names.str.replace(r'\s*[&/]\s*', ' AND ', regex=True)
+    names = names.str.replace(r'[^\w\s]', ' ', regex=True)
+    return names.str.split().str.join(' ')
+
+def normalize_addresses(addresses):
+    """
+    Normalizes vote center addresses to their street address, which is written
+    before "--" in the voting data and before the first "," in the vote center
+    geojson (e.g. "12505 VISTA DEL MAR --  ,  PLAYA DEL REY CA" and
+    "12505 Vista Del Mar, Playa Del Rey, 90293" to "12505 VISTA DEL MAR").
+
+    Args:
+    addresses (pandas series): Vote center addresses.
+
+    Return:
+    addresses (pandas series): Normalized street addresses.
+    """
+    addresses = addresses.str.split(r'--|,', n=1, regex=True).str[0].str.upper()
+    addresses = addresses.str.replace(r'[^\w\s]', ' ', regex=True)
+    return addresses.str.split().str.join(' ')
+
+def read_overrides(override_file):
+    """
+    Reads the manual vote center name matches, a csv of voting data names
+    ('Vote Location Name') and the vote center geojson names they match ('Name').
+
+    Args:
+    override_file (str): File location for the overrides
+        (filename: "vc_name_overrides.csv").
+
+    Return:
+    overrides (dict): Geojson name for each voting data name, empty if the file doesn't exist.
+    """
+    if not os.path.exists(override_file):
+        return {}
+    overrides = pd.read_csv(override_file, dtype=str)
+    return dict(zip(overrides['Vote Location Name'], overrides['Name']))
+
+def match_vote_centers(vc, vc_gdf, overrides=None, cutoff=0.8):
+    """
+    Matches the vote centers in the voting data to the vote center geojson by
+    name. Each vote center is matched by the first of:
+    - 'override': the manual match in the overrides
+    - 'exact': the same name
+    - 'normalized': the same name after normalize_names()
+    - 'fuzzy': the most similar normalized name among the vote centers at the same
+      street address that have not been matched and have a unique name, if its
+      similarity is at least the cutoff
+    Names and addresses are indexed once, so only the vote centers left after the
+    lookups are compared with difflib, and only with the vote centers at their address.
+
+    Args:
+    vc (pandas dataframe): Voting data with 'Vote Location Name' and 'Vote Location Address'.
+    vc_gdf (geopandas dataframe): Vote center geojson with 'Name' and 'Address'.
+    overrides (dict): Geojson name for voting data names that can't be matched
+        otherwise, from read_overrides() (default none).
+    cutoff (float): Minimum difflib similarity for a fuzzy match (default 0.8).
+
+    Return:
+    matches (pandas dataframe): For each row of vc, the 'Vote Location Name', the
+        matched geojson 'Name' (na if unmatched), the 'method' and the 'score'
+        (1 for overrides and exact or normalized names, na if unmatched).
+    """
+    names = vc['Vote Location Name']
+    gdf_names = vc_gdf['Name'].dropna().drop_duplicates()
+    normalized_index = pd.Series(gdf_names.to_numpy(), index=normalize_names(gdf_names)).groupby(level=0).first()
+    matches = pd.DataFrame({'Vote Location Name' : names, 'Name' : pd.Series(pd.NA, index=vc.index, dtype=object),
+        'method' : pd.Series(pd.NA, index=vc.index, dtype=object), 'score' : float('nan')})
+    # exact lookups against the overrides, the geojson names and the normalized names
+    lookups = {
+        'override' : names.map(overrides or {}),
+        'exact' : names.where(names.isin(gdf_names)),
+        'normalized' : normalize_names(names).map(normalized_index),
+    }
+    for method, matched in lookups.items():
+        found = matches['Name'].isna() & matched.notnull()
+        matches.loc[found, 'Name'] = matched[found]
+        matches.loc[found, 'method'] = method
+        matches.loc[found, 'score'] = 1.0
+    # fuzzy match the rest by name among the unclaimed vote centers at the same address
+    unique_names = vc_gdf['Name'].drop_duplicates(keep=False)
+    candidates = vc_gdf.loc[vc_gdf['Name'].isin(unique_names) & ~vc_gdf['Name'].isin(matches['Name'])]
+    address_index = pd.Series(candidates['Name'].to_numpy(),
+        index=normalize_addresses(candidates['Address'])).groupby(level=0).agg(list)
+    unmatched = matches['Name'].isna() & names.notnull()
+    addresses = normalize_addresses(vc.loc[unmatched, 'Vote Location Address'])
+    normalized_names = normalize_names(names[unmatched])
+    claimed = set()
+    for row, address in addresses.items():
+        options = [name for name in address_index.get(address, []) if name not in claimed]
+        if len(options) == 0:
+            continue
+        scores = [difflib.SequenceMatcher(None, normalized_names[row], option).ratio() 
+            for option in normalize_names(pd.Series(options))]
+        best = max(range(len(options)), key=scores.__getitem__)
+        if scores[best] >= cutoff:
+            matches.loc[row, ['Name', 'method', 'score']] = [options[best], 'fuzzy', scores[best]]
+            claimed.add(options[best])
+    return matches
+
+def report_matches(matches, vc_gdf):
+    """
+    Prints the number of vote centers matched by each method, the fuzzy matches
+    with their similarity, and the vote centers that were not matched.
+
+    Args:
+    matches (pandas dataframe): Output of match_vote_centers().
+    vc_gdf (geopandas dataframe): Vote center geojson with 'Name'.
+    """
+    print()
+    print('Vote centers in voting data matched to vote center locations:')
+    counts = matches['method'].fillna('unmatched').value_counts()
+    for method in ['exact', 'normalized', 'override', 'fuzzy', 'unmatched']:
+        print('  %-10s %d' % (method, counts.get(method, 0)))
+    fuzzy = matches.loc[matches['method'] == 'fuzzy'].sort_values('score')
+    if len(fuzzy) > 0:
+        print('  fuzzy match similarity: min %.2f, mean %.2f' % (fuzzy['score'].min(), fuzzy['score'].mean()))
+    for _, row in fuzzy.iterrows():
+        print('    %.2f %s -> %s' % (row['score'], row['Vote Location Name'], row['Name']))
+    unmatched = matches.loc[matches['Name'].isna(), 'Vote Location Name'].dropna()
+    for name in unmatched:
+        print('    unmatched:', name)
+    print('Vote center locations without voting data:', (~vc_gdf['Name'].isin(matches['Name'])).sum())
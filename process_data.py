@@ -1,65 +1,228 @@
-from lavote_data_processing import round_gdf, round_polygon, process_precincts, process_votecenters
-import os,sys
+from lavote_data_processing import round_gdf, round_polygon, process_precincts, process_votecenters, record_history
+from instrumentation import configure, stage, pop_stages, peak_rss, write_run_log, print_stages
+import os,sys,re
+import time
 import zipfile
+import argparse
+import traceback
+from concurrent.futures import ProcessPoolExecutor
 
 precincts_shape = 'data/static/registrar_precincts_4326/registrar_precincts.shp'
-registered_voters = 'data/most_recent/1- Count of registered voters by precinct.csv'
-voters = 'data/most_recent/2- Count of votes cast (broken out by VBM and in-person ballots) by precinct and VBM return method.csv'
+registered_voters = '1- Count of registered voters by precinct.csv'
+voters = '2- Count of votes cast (broken out by VBM and in-person ballots) by precinct and VBM return method.csv'
 output_loc = 'data/final_geojsons'
 votecenter_gjson = 'data/static/vote_centers_locs.geojson'
-votecenter_voters = 'data/most_recent/3- Count of in-person ballots cast for each vote center with VBM return method_LA.csv'
+votecenter_voters = '3- Count of in-person ballots cast for each vote center with VBM return method_LA.csv'
 votecenter_alloc = 'data/static/LA Vote Center_allocations_20201027.xlsx'
 data_folder = 'data/most_recent/'
 
-most_recent_files = os.listdir(data_folder)
-zipfiles = [data_folder+file for file in most_recent_files if '.zip' in file]
-if len(zipfiles) == 0:
-	print("zip file not found, confirm you have moved it to",'GitHub/la-vote/'+data_folder)
-	sys.exit(42)
-zipfiles.sort(key=os.path.getmtime)
-most_recent_zip = zipfiles[-1] # Getting most recent file, assuming naming system is maintained
-print("Working on file:",most_recent_zip)
-with zipfile.ZipFile(most_recent_zip, 'r') as zip_ref:
-	zip_ref.extractall(data_folder)
-
-if not os.path.exists(output_loc+'/precincts'):
-	os.mkdir(output_loc+'/precincts')
-if not os.path.exists(output_loc+'/vote_centers'):
-	os.mkdir(output_loc+'/vote_centers')
-
-process_precincts(precincts_shape, registered_voters, voters, output_loc, reduce_file=True, places=6)
-process_votecenters(votecenter_gjson, votecenter_voters, votecenter_alloc, output_loc)
-
-# Replacing update time in index.html using zip file name
-
-zip_string = most_recent_zip.split('/')[-1].split('.')[0]
-date_string, time_string = zip_string.split('_')
-if len(date_string) != 8:
-	print("Cannot get date from file name, check manually: index.html FILE NOT UPDATED")
-	sys.exit(42)
-month_string = date_string[0:2].lstrip('0')
-day_string = date_string[2:4].lstrip('0')
-year_string = date_string[4:8]
-
-ampm_string = ''.join([s for s in time_string if s.isalpha()]).lower()
-if ampm_string == 'noon':
-	ampm_string = 'pm'
-if ampm_string not in ['am','pm']:
-	print("Cannot get time from file name, check manually: index.html FILE NOT UPDATED")
-	sys.exit(42)
-clock_string = ''.join([s for s in time_string if s.isdigit()])
-minute_string = clock_string[-2:]
-hour_string = clock_string[:-2]
-
-update_string = "Last Updated: %s:%s %s on %s/%s/%s" % (hour_string, minute_string, ampm_string, month_string, day_string, year_string)
-
-with open('index.html', 'r') as html_file:
-	html_text = html_file.read()
-
-update_start_pos = html_text.find("Last Updated:")
-update_end_pos = html_text[update_start_pos:].find('<')
-update_old_text = html_text[update_start_pos:update_start_pos+update_end_pos]
-html_text = html_text.replace(update_old_text, update_string)
-
-with open('index.html', 'w') as html_file:
-	html_file.write(html_text)
+def extract_name(zip_file):
+	"""
+	Name of the extract the csvs are cached under, the zip file name without its 
+	extension (e.g. "12082020_900am").
+	"""
+	return zip_file.split('/')[-1].split('.')[0]
+
+def run_precincts(zip_file, output_format):
+	"""
+	Runs the precinct pipeline on the registered voter and votes cast csvs, read
+	directly from the zip file or from their cached copies if the zip file has 
+	been read before.
+
+	Return:
+	precinct_files (list): File locations of the precinct files for index.html to load.
+	"""
+	with zipfile.ZipFile(zip_file, 'r') as zip_ref:
+		with zip_ref.open(registered_voters) as reg_file, zip_ref.open(voters) as vote_file:
+			return process_precincts(precincts_shape, reg_file, vote_file, output_loc, reduce_file=True, places=6,
+				output_format=output_format, extract=extract_name(zip_file))
+
+def run_votecenters(zip_file):
+	"""
+	Runs the vote center pipeline on the vote center csv, read directly from the zip file
+	or from its cached copy if the zip file has been read before.
+	"""
+	with zipfile.ZipFile(zip_file, 'r') as zip_ref:
+		with zip_ref.open(votecenter_voters) as vc_file:
+			return process_votecenters(votecenter_gjson, vc_file, votecenter_alloc, output_loc, extract=extract_name(zip_file))
+
+def backfill_history(zip_file):
+	"""
+	Adds the precinct and vote center counts from an archived zip file to the 
+	history store, reading the csvs directly from the zip file.
+
+	Return:
+	added (list): Kinds of counts added to the store.
+	"""
+	with zipfile.ZipFile(zip_file, 'r') as zip_ref:
+		with zip_ref.open(registered_voters) as reg_file, zip_ref.open(voters) as vote_file, zip_ref.open(votecenter_voters) as vc_file:
+			return record_history(reg_file, vote_file, votecenter_gjson, vc_file, extract_name(zip_file))
+
+def backfill(folder):
+	"""
+	Backfills the history store from every archived zip file in a folder named 
+	like the registrar's extracts (e.g. "12082020_900am.zip"), processing the zip 
+	files in parallel. index.html and the map outputs are not changed.
+	"""
+	zipfiles = sorted(folder.rstrip('/')+'/'+file for file in os.listdir(folder)
+		if re.fullmatch(r'\d{8}_\d{3,4}(am|pm|noon)\.zip', file, flags=re.IGNORECASE))
+	print("Backfilling history from", len(zipfiles), "zip files in", folder)
+	failed = []
+	with ProcessPoolExecutor() as pool:
+		futures = {zip_file : pool.submit(backfill_history, zip_file) for zip_file in zipfiles}
+		for zip_file, future in futures.items():
+			try:
+				added = future.result()
+				print(zip_file + ':', ', '.join(added) if added else 'already in history')
+			except Exception:
+				print(zip_file, 'failed:')
+				traceback.print_exc()
+				failed.append(zip_file)
+	return failed
+
+def timed(name, profile, func, *args):
+	"""
+	Runs a pipeline in a worker process as a stage recorded by instrumentation.stage(),
+	profiling it with cProfile or tracemalloc if profile is set.
+
+	Return:
+	(result, stages, error): Result of the pipeline (None if it failed), the records
+		of its stages and the traceback if it failed (None if it succeeded).
+	"""
+	configure(profile)
+	result, error = None, None
+	try:
+		with stage(name):
+			result = func(*args)
+	except Exception:
+		error = traceback.format_exc()
+	finally:
+		# send back the stages of a failed pipeline too, it is the run that needs diagnosing
+		stages = pop_stages()
+	return result, stages, error
+
+def update_precinct_scripts(precinct_files):
+	"""
+	Points index.html at the precinct files for the selected output format,
+	replacing the script tags between the precinct layer comments.
+	"""
+	with open('index.html', 'r') as html_file:
+		html_text = html_file.read()
+	layer_start = html_text.find('<!-- precinct layer: start -->\n') + len('<!-- precinct layer: start -->\n')
+	layer_end = html_text.find('<!-- precinct layer: end -->')
+	precinct_scripts = ''.join(['<script type="text/javascript" src="%s"></script>\n' % file for file in precinct_files])
+	html_text = html_text[:layer_start] + precinct_scripts + html_text[layer_end:]
+	with open('index.html', 'w') as html_file:
+		html_file.write(html_text)
+
+def update_timestamp(zip_file):
+	"""
+	Replaces the update time in index.html using the zip file name
+	(e.g. "12082020_900am.zip").
+
+	Return:
+	updated (bool): Whether the date and time could be read from the file name.
+	"""
+	zip_string = extract_name(zip_file)
+	date_string, time_string = zip_string.split('_')
+	if len(date_string) != 8:
+		print("Cannot get date from file name, check manually: index.html FILE NOT UPDATED")
+		return False
+	month_string = date_string[0:2].lstrip('0')
+	day_string = date_string[2:4].lstrip('0')
+	year_string = date_string[4:8]
+
+	ampm_string = ''.join([s for s in time_string if s.isalpha()]).lower()
+	if ampm_string == 'noon':
+		ampm_string = 'pm'
+	if ampm_string not in ['am','pm']:
+		print("Cannot get time from file name, check manually: index.html FILE NOT UPDATED")
+		return False
+	clock_string = ''.join([s for s in time_string if s.isdigit()])
+	minute_string = clock_string[-2:]
+	hour_string = clock_string[:-2]
+
+	update_string = "Last Updated: %s:%s %s on %s/%s/%s" % (hour_string, minute_string, ampm_string, month_string, day_string, year_string)
+
+	with open('index.html', 'r') as html_file:
+		html_text = html_file.read()
+
+	update_start_pos = html_text.find("Last Updated:")
+	update_end_pos = html_text[update_start_pos:].find('<')
+	update_old_text = html_text[update_start_pos:update_start_pos+update_end_pos]
+	html_text = html_text.replace(update_old_text, update_string)
+
+	with open('index.html', 'w') as html_file:
+		html_file.write(html_text)
+	return True
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Process the most recent zip file in data/most_recent for the LA vote map.')
+	parser.add_argument('--format', choices=['split', 'geojson', 'topojson', 'tiles'], default='split',
+		help='output format for the precinct layer loaded by index.html (default split)')
+	parser.add_argument('--backfill', nargs='?', const=data_folder, metavar='FOLDER',
+		help='only add the counts from every archived zip file in FOLDER to the history store (default %s)' % data_folder)
+	parser.add_argument('--profile', choices=['cprofile', 'tracemalloc'],
+		help='profile each pipeline, writing the dumps to data/profiles')
+	parser.add_argument('--run-log', default='data/runs', metavar='DIR',
+		help='directory to write the JSON run log of stage timings, memory and rows to (default data/runs)')
+	args = parser.parse_args()
+	if args.backfill:
+		sys.exit(42 if backfill(args.backfill) else 0)
+	run_start = time.perf_counter()
+
+	most_recent_files = os.listdir(data_folder)
+	zipfiles = [data_folder+file for file in most_recent_files if '.zip' in file]
+	if len(zipfiles) == 0:
+		print("zip file not found, confirm you have moved it to",'GitHub/la-vote/'+data_folder)
+		sys.exit(42)
+	zipfiles.sort(key=os.path.getmtime)
+	most_recent_zip = zipfiles[-1] # Getting most recent file, assuming naming system is maintained
+	print("Working on file:",most_recent_zip)
+
+	if not os.path.exists(output_loc+'/precincts'):
+		os.mkdir(output_loc+'/precincts')
+	if not os.path.exists(output_loc+'/vote_centers'):
+		os.mkdir(output_loc+'/vote_centers')
+
+	# run the precinct and vote center pipelines side by side, they only share the
+	# zip file and write to separate outputs
+	stages = {
+		'precincts' : (run_precincts, most_recent_zip, args.format),
+		'vote centers' : (run_votecenters, most_recent_zip),
+	}
+	results, records, failed, errors = {}, [], [], {}
+	with ProcessPoolExecutor(max_workers=len(stages)) as pool:
+		futures = {name : pool.submit(timed, name, args.profile, *task) for name, task in stages.items()}
+		for name, future in futures.items():
+			try:
+				results[name], pipeline_records, errors[name] = future.result()
+				records += pipeline_records
+			except Exception:
+				# the worker process itself failed, so there are no stages to send back
+				errors[name] = traceback.format_exc()
+			if errors[name] is not None:
+				print("%s pipeline failed:" % name.capitalize())
+				print(errors[name])
+				failed.append(name)
+			else:
+				del errors[name]
+
+	# point index.html at the new precinct files and only update the timestamp
+	# once both pipelines have succeeded
+	if 'precincts' not in failed:
+		update_precinct_scripts(results['precincts'])
+	if failed:
+		print("Failed:", ', '.join(failed), "- index.html timestamp NOT UPDATED")
+	elif not update_timestamp(most_recent_zip):
+		failed.append('timestamp')
+
+	# record the stages of both pipelines, in their worker processes, and the whole run
+	records.append({'stage' : 'total', 'rows' : None, 'seconds' : round(time.perf_counter() - run_start, 4), 
+		'peak_rss_mb' : peak_rss()})
+	print()
+	print_stages(records)
+	print("Run log written to", write_run_log(records, args.run_log, extract=extract_name(most_recent_zip), 
+		format=args.format, profile=args.profile, failed=failed, errors=errors))
+	if failed:
+		sys.exit(42)
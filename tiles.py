@@ -0,0 +1,117 @@
+import numpy as np
+import os
+import json
+import math
+import shutil
+import shapely
+from concurrent.futures import ProcessPoolExecutor
+
+# features shared with worker processes by _init_worker()
+_geometries = None
+_properties = None
+
+def tile_ranges(bounds, zoom):
+    """
+    Takes in an array of lon/lat bounds and finds the range of web mercator
+    (slippy map) tiles each one covers at a zoom level.
+
+    Args:
+    bounds (numpy array): Array of (minx, miny, maxx, maxy) bounds in EPSG:4326.
+    zoom (int): Zoom level.
+
+    Return:
+    ranges (numpy array): Array of (min x, min y, max x, max y) tile numbers.
+    """
+    n = 2**zoom
+    def x_tile(lon):
+        return np.clip(np.floor((lon + 180)/360*n), 0, n - 1).astype('int64')
+    def y_tile(lat):
+        lat = np.radians(np.clip(lat, -85.0511, 85.0511))
+        return np.clip(np.floor((1 - np.arcsinh(np.tan(lat))/math.pi)/2*n), 0, n - 1).astype('int64')
+    return np.stack([x_tile(bounds[:, 0]), y_tile(bounds[:, 3]), x_tile(bounds[:, 2]), y_tile(bounds[:, 1])], axis=1)
+
+def zoom_tolerance(zoom):
+    """
+    Simplification tolerance in degrees for a zoom level, half a pixel of a
+    256 pixel tile at the equator.
+    """
+    return 360/(256*2**zoom)/2
+
+def _init_worker(geometries, properties):
+    global _geometries, _properties
+    _geometries = geometries
+    _properties = properties
+
+def _write_tiles(zoom, x_min, x_max, in_band, ranges, tile_dir, simplify):
+    """
+    Writes the tiles in a band of tile columns at a zoom level, simplifying the
+    geometries that fall in the band with the zoom level's tolerance. Runs in a
+    worker process on the features shared by _init_worker().
+
+    Args:
+    in_band (numpy array): Indices of the features that overlap the band.
+    ranges (numpy array): Tile ranges of those features from tile_ranges().
+
+    Return:
+    count (int): Number of tiles written.
+    """
+    geometries = _geometries[in_band]
+    if simplify:
+        tolerance = zoom_tolerance(zoom)
+        places = math.ceil(-math.log10(tolerance))
+        geometries = shapely.simplify(geometries, tolerance)
+        geometries = shapely.transform(geometries, lambda coords: np.round(coords, places))
+    features = ['{"type":"Feature","properties":' + _properties[i] + ',"geometry":' + geometry + '}'
+        for i, geometry in zip(in_band, shapely.to_geojson(geometries))]
+    tiles = {}
+    for feature, (x0, y0, x1, y1) in zip(features, ranges):
+        for x in range(max(x0, x_min), min(x1, x_max) + 1):
+            for y in range(y0, y1 + 1):
+                tiles.setdefault((x, y), []).append(feature)
+    for (x, y), tile_features in tiles.items():
+        os.makedirs(f'{tile_dir}/{zoom}/{x}', exist_ok=True)
+        with open(f'{tile_dir}/{zoom}/{x}/{y}.json', 'w', encoding='utf-8') as f:
+            f.write('{"type":"FeatureCollection","features":[\n' + ',\n'.join(tile_features) + '\n]}\n')
+    return len(tiles)
+
+def write_tile_pyramid(gdf, tile_dir, minzoom=9, maxzoom=14, workers=None):
+    """
+    Cuts a geopandas dataframe of polygons into a static z/x/y pyramid of GeoJSON
+    tiles that can be served from the same host as the map. Each zoom level is
+    simplified with its own tolerance of half a pixel, except the highest zoom
+    level which keeps the full geometry. Features are not clipped, so a feature
+    is written to every tile it overlaps. Tiles are written by a pool of worker
+    processes, one task per band of tile columns.
+
+    Args:
+    gdf (geopandas dataframe): Geopandas dataframe in EPSG:4326 with no empty geometry.
+    tile_dir (str): Directory location to write tiles to, as {z}/{x}/{y}.json.
+    minzoom (int): Lowest zoom level to cut tiles for (default 9).
+    maxzoom (int): Highest zoom level to cut tiles for (default 14).
+    workers (int): Number of worker processes (default is the number of cpus).
+
+    Return:
+    count (int): Number of tiles written.
+    """
+    workers = workers or os.cpu_count()
+    geometries = np.asarray(gdf.geometry.values)
+    props = gdf.drop(columns=gdf.geometry.name)
+    props = props.astype(object).where(props.notnull(), None)
+    properties = [json.dumps(dict(zip(props.columns, values)), ensure_ascii=False, separators=(',', ':'), default=str)
+        for values in props.itertuples(index=False, name=None)]
+    # split every zoom level into bands of tile columns so the work is spread across workers,
+    # finding the tiles each feature covers once per zoom level and sending each task its features
+    bounds = shapely.bounds(geometries)
+    tasks = []
+    for zoom in range(minzoom, maxzoom + 1):
+        ranges = tile_ranges(bounds, zoom)
+        x_min, x_max = ranges[:, 0].min(), ranges[:, 2].max()
+        bands = min(x_max - x_min + 1, workers)
+        for band in np.array_split(np.arange(x_min, x_max + 1), bands):
+            in_band = np.flatnonzero((ranges[:, 0] <= band[-1]) & (ranges[:, 2] >= band[0]))
+            tasks.append((zoom, band[0], band[-1], in_band, ranges[in_band], tile_dir, zoom < maxzoom))
+    if os.path.exists(tile_dir):
+        shutil.rmtree(tile_dir)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(geometries, properties)) as pool:
+        futures = [pool.submit(_write_tiles, *task) for task in tasks]
+        return sum(future.result() for future in futures)
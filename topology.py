@@ -0,0 +1,106 @@
+import numpy as np
+import shapely
+
+def build_topology(geometries, places=6):
+    """
+    Takes in an array of polygon geometries and encodes them as a TopoJSON style
+    topology. Coordinates are quantized to the specified number of decimal places,
+    rings are cut into arcs at the points where neighboring boundaries meet or
+    split, and arcs shared by adjacent polygons are stored once and referenced
+    from both (reversed arcs are referenced as ~index). Arcs are delta encoded.
+
+    Args:
+    geometries (numpy array): Array of shapely Polygons, MultiPolygons or None.
+    places (int): Number of decimal places coordinates are quantized to
+        (default is 6, .01m accuracy).
+
+    Return:
+    topology (dict): Topology with 'transform', 'arcs' and 'geometries', where
+        each geometry is a dict with 'type' and 'arcs' (type None for empty geometry).
+    """
+    geometries = np.asarray(geometries, dtype=object)
+    # break geometries into polygons and polygons into rings, keeping track of where each came from
+    parts, part_geom = shapely.get_parts(geometries, return_index=True)
+    rings, ring_part = shapely.get_rings(parts, return_index=True)
+    coords, point_ring = shapely.get_coordinates(rings, return_index=True)
+    scale = 10.0**-places
+    translate = coords.min(axis=0) if len(coords) else np.zeros(2)
+    quantized = np.rint((coords - translate)/scale).astype('int64')
+    # drop the closing point of each ring and repeated points created by quantizing
+    last = np.r_[point_ring[1:] != point_ring[:-1], True]
+    repeat = np.r_[False, (quantized[1:] == quantized[:-1]).all(axis=1) & (point_ring[1:] == point_ring[:-1])]
+    keep = ~last & ~repeat
+    quantized, point_ring = quantized[keep], point_ring[keep]
+    keys = quantized[:, 0]*(1 << 32) + quantized[:, 1]
+    # find each ring's points and the neighbors of every point going around the ring
+    starts = np.searchsorted(point_ring, np.arange(len(rings)))
+    ends = np.searchsorted(point_ring, np.arange(len(rings)), side='right')
+    position = np.arange(len(keys))
+    prev = np.where(position == starts[point_ring], ends[point_ring] - 1, position - 1)
+    nxt = np.where(position == ends[point_ring] - 1, starts[point_ring], position + 1)
+    # a point is a junction if it is visited with more than one pair of neighbors,
+    # which is where shared boundaries start and end
+    neighbors = np.stack([keys, np.minimum(keys[prev], keys[nxt]), np.maximum(keys[prev], keys[nxt])], axis=1)
+    point_keys, neighbor_pairs = np.unique(np.unique(neighbors, axis=0)[:, 0], return_counts=True)
+    junction_keys = point_keys[neighbor_pairs > 1]
+    junction = np.isin(keys, junction_keys)
+
+    arcs = []
+    arc_index = {}
+    def add_arc(arc_keys, arc_points):
+        # reuse an arc that was already stored in either direction
+        key = arc_keys.tobytes()
+        if key in arc_index:
+            return arc_index[key]
+        reverse = arc_keys[::-1].tobytes()
+        if reverse in arc_index:
+            return ~arc_index[reverse]
+        arc_index[key] = len(arcs)
+        arcs.append(np.vstack([arc_points[:1], np.diff(arc_points, axis=0)]).tolist())
+        return arc_index[key]
+
+    ring_arcs = []
+    for start, end in zip(starts, ends):
+        if end - start < 3:
+            ring_arcs.append(None)
+            continue
+        ring_keys, ring_points, ring_junctions = keys[start:end], quantized[start:end], np.flatnonzero(junction[start:end])
+        if len(ring_junctions) == 0:
+            # rings without junctions are stored whole, starting from their smallest point
+            # so the same ring in two geometries (e.g. an island and a hole) is only stored once
+            first = np.argmin(ring_keys)
+            order = np.r_[np.arange(first, len(ring_keys)), np.arange(first + 1)]
+            ring_arcs.append([add_arc(ring_keys[order], ring_points[order])])
+            continue
+        # rotate the ring to start at a junction and cut it into arcs at every junction
+        order = np.r_[np.arange(ring_junctions[0], len(ring_keys)), np.arange(ring_junctions[0] + 1)]
+        cuts = np.r_[ring_junctions - ring_junctions[0], len(ring_keys)]
+        ring_keys, ring_points = ring_keys[order], ring_points[order]
+        ring_arcs.append([add_arc(ring_keys[a:b + 1], ring_points[a:b + 1]) for a, b in zip(cuts[:-1], cuts[1:])])
+
+    # rebuild the geometries from their rings' arcs, dropping degenerate rings and
+    # polygons whose exterior ring is degenerate
+    exterior = np.r_[True, ring_part[1:] != ring_part[:-1]]
+    polygons = [[] for _ in range(len(parts))]
+    for ring, part, is_exterior in zip(ring_arcs, ring_part, exterior):
+        if ring is None and is_exterior:
+            polygons[part] = None
+        elif ring is not None and polygons[part] is not None:
+            polygons[part].append(ring)
+    geometry_polygons = [[] for _ in range(len(geometries))]
+    for polygon, geom in zip(polygons, part_geom):
+        if polygon:
+            geometry_polygons[geom].append(polygon)
+    topology_geometries = []
+    for geometry, polygon_arcs in zip(geometries, geometry_polygons):
+        if len(polygon_arcs) == 0:
+            topology_geometries.append({'type' : None})
+        elif shapely.get_type_id(geometry) == 3:
+            topology_geometries.append({'type' : 'Polygon', 'arcs' : polygon_arcs[0]})
+        else:
+            topology_geometries.append({'type' : 'MultiPolygon', 'arcs' : polygon_arcs})
+    return {
+        'transform' : {'scale' : [scale, scale], 'translate' : translate.tolist()},
+        'arcs' : arcs,
+        'geometries' : topology_geometries,
+    }